@@ -1,30 +1,162 @@
 import asyncio
 import logging
-import json
+import logging.handlers
 import os
+import queue
+import signal
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from enum import Enum, auto
+from itertools import islice
+from functools import lru_cache
 import aiosqlite
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+import orjson
+from aiohttp import web
+from typing import Deque, Dict, List, Optional, Tuple, Union
+from dataclasses import dataclass, field
 from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
 from telebot.types import (
     InlineKeyboardMarkup, InlineKeyboardButton, 
-    Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
+    Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, Update,
+    ChatMemberUpdated
 )
 
 # ========================
 # 🎯 CONFIGURATION
 # ========================
-class Config:
-    API_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '8517027491:AAEUZVzbAMjj99d4JHVUi1c-IJXAC_apPT0')
-    ADMIN_ID = int(os.getenv('ADMIN_ID', '7609512291'))
-    MANDATORY_CHANNEL = "@hu_quizzes"
-    DB_FILE = "quiz_bot.db"
+# Read once at import and frozen, so nothing can change settings at runtime
+@dataclass(slots=True, frozen=True)
+class _Config:
+    API_TOKEN: str = os.getenv('TELEGRAM_BOT_TOKEN', '8517027491:AAEUZVzbAMjj99d4JHVUi1c-IJXAC_apPT0')
+    ADMIN_ID: int = int(os.getenv('ADMIN_ID', '7609512291'))
+    MANDATORY_CHANNEL: str = "@hu_quizzes"
+    DB_FILE: str = "quiz_bot.db"
+    DB_READERS: int = min(8, os.cpu_count() or 4)
+    # Exclusive locking skips the per-transaction file locks, but no other connection
+    # or process can open DB_FILE then, so reads go through the writer instead
+    DB_EXCLUSIVE: bool = os.getenv('DB_EXCLUSIVE', '') == '1'
+    # Webhook mode is used when WEBHOOK_URL is set, long polling otherwise
+    WEBHOOK_URL: str = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_PATH: str = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_HOST: str = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT: int = int(os.getenv('WEBHOOK_PORT', '8080'))
+    WEBHOOK_SECRET: str = os.getenv('WEBHOOK_SECRET', '')
+    UPDATE_CONCURRENCY: int = 256
+    # Long polling parks each getUpdates on Telegram's side; the HTTP timeout must outlast it
+    POLL_TIMEOUT: int = 50
+    POLL_REQUEST_TIMEOUT: int = 60
+    SHUTDOWN_GRACE: float = 5.0
+    # chat_member updates only arrive while the bot is an admin of MANDATORY_CHANNEL
+    ALLOWED_UPDATES: Tuple[str, ...] = ("message", "callback_query", "chat_member")
+    SEND_CONCURRENCY: int = 25
+    SEND_RETRIES: int = 3
+    GLOBAL_SEND_RATE: int = 30
+    GROUP_SEND_LIMIT: int = 20
+    GROUP_SEND_PERIOD: float = 60.0
+    PROGRESS_FLUSH_INTERVAL: float = 0.1
+    PROGRESS_CACHE_SIZE: int = 10000
+    DASHBOARD_CACHE_TTL: float = 5.0
+    DB_OPTIMIZE_INTERVAL: float = 6 * 3600.0
+    MEMBER_CHECK_CONCURRENCY: int = 20
+    MEMBERSHIP_CACHE_TTL: float = 300.0
+    DELETED_MESSAGES_CACHE: int = 10000
+    SCORES_PAGE_SIZE: int = 20
+    HELP_PAGE_SIZE: int = 10
+
+Config = _Config()
+
+# ========================
+# 🎨 UI CONSTANTS
+# ========================
+# Legacy Markdown only knows these markers; a stray one in a name makes Telegram reject the message
+_MD_ESCAPES = str.maketrans({c: "\\" + c for c in "_*`["})
+
+def _md_escape(text: str) -> str:
+    return text.translate(_MD_ESCAPES)
+
+_ANSWER_EMOJI = ("🅰️", "🅱️", "🇨", "🇩")
+_FALLBACK_EMOJI = tuple(f"{i+1}️⃣" for i in range(len(_ANSWER_EMOJI), 20))
+_OPTION_EMOJI = _ANSWER_EMOJI + _FALLBACK_EMOJI
+_MEDAL_EMOJI = ("🥇", "🥈", "🥉")
+# Shared by every admin screen that returns to the dashboard
+_ADMIN_BACK_BUTTON = InlineKeyboardButton("🔙 Back", callback_data="admin_dashboard")
+
+_MAIN_MENU_TEXT = """✨ **Welcome to HU Quizzes!** ✨
+
+🎯 Take interactive quizzes
+📊 Track your progress  
+🏆 Compete with others
+💬 Get support
+
+**Choose an option below:**"""
+
+_CHANNEL_REQUIREMENT_TEXT = f"""🔒 **Channel Membership Required**
+
+To access quizzes, join our channel first!
+
+📢 **Channel:** {_md_escape(Config.MANDATORY_CHANNEL)}
+
+**After joining, click "I've Joined" below!**"""
+
+_PROFILE_CONFIRMATION_TEXT = """👤 **Profile Confirmation**
+
+Confirm your profile to continue!"""
+
+_HELP_OPTIONS_TEXT = """💬 **Help & Support**
+
+Need help? Choose below:"""
+
+_ADMIN_DASHBOARD_TEXT = """
+👑 **ADMIN DASHBOARD**
+
+📊 **Statistics:**
+├ 👥 **Users:** `{total_users}`
+└ 📩 **Pending Help:** `{pending_help}`
+
+**Select an action:**"""
+
+_ADMIN_SETTINGS_TEXT = f"""
+⚙️ **Bot Settings**
+
+**Config:**
+• **Admin ID:** `{Config.ADMIN_ID}`
+• **Channel:** `{Config.MANDATORY_CHANNEL}`
+• **Database:** `{Config.DB_FILE}`
+
+**Quick Actions:**"""
+
+_UPLOAD_GUIDE_TEXT = """
+📤 **Upload Quiz JSON**
+
+**Step 1: Add Subject**
+1. Click '➕ Add Subject'
+2. Enter subject name
+
+**Step 2: Add Chapter**
+1. Click '📖 Add Chapter'  
+2. Enter chapter name
+
+**Step 3: Upload JSON**
+Send JSON file as document
+
+**JSON Format:**
+```json
+[
+  {
+    "question": "Question?",
+    "options": ["A", "B", "C", "D"],
+    "correct": 0,
+    "explanation": "Explanation"
+  }
+]
+```"""
 
 # ========================
 # 📊 DATA MODELS
 # ========================
-@dataclass
+@dataclass(slots=True, frozen=True)
 class User:
     user_id: int
     name: str
@@ -32,14 +164,14 @@ class User:
     profile_confirmed: bool = False
     joined_channel: bool = False
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Question:
     question: str
     options: List[str]
     correct: int
     explanation: str
 
-@dataclass
+@dataclass(slots=True)
 class QuizProgress:
     user_id: int
     chapter_id: int
@@ -49,7 +181,27 @@ class QuizProgress:
     last_message_id: Optional[int] = None
     completed: bool = False
 
-@dataclass
+class UserState(Enum):
+    IDLE = auto()
+    WAITING_SUBJECT = auto()
+    WAITING_CHAPTER = auto()
+    WAITING_UPLOAD = auto()
+    WAITING_HELP_REPLY = auto()
+    ASKING_QUESTION = auto()
+
+@dataclass(slots=True)
+class StateCtx:
+    state: UserState
+    subject_name: Optional[str] = None
+    chapter_name: Optional[str] = None
+    help_request_id: Optional[int] = None
+
+@dataclass(slots=True)
+class StateLock:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    users: int = 0  # holders plus waiters; the entry is dropped when this reaches 0
+
+@dataclass(slots=True)
 class HelpRequest:
     user_id: int
     message: str
@@ -57,97 +209,288 @@ class HelpRequest:
     created_at: str = None
     replied_at: Optional[str] = None
 
+_SCHEMA = """
+    BEGIN;
+
+    -- Users table
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        username TEXT,
+        profile_confirmed BOOLEAN DEFAULT FALSE,
+        joined_channel BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Subjects and chapters
+    CREATE TABLE IF NOT EXISTS subjects (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        description TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS chapters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        subject_id INTEGER,
+        name TEXT NOT NULL,
+        FOREIGN KEY (subject_id) REFERENCES subjects(id)
+    );
+
+    -- Quizzes
+    CREATE TABLE IF NOT EXISTS quizzes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chapter_id INTEGER,
+        questions TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (chapter_id) REFERENCES chapters(id)
+    );
+
+    -- User progress
+    CREATE TABLE IF NOT EXISTS user_progress (
+        user_id INTEGER,
+        chapter_id INTEGER,
+        current_index INTEGER DEFAULT 0,
+        score INTEGER DEFAULT 0,
+        answers TEXT DEFAULT '[]',
+        completed BOOLEAN DEFAULT FALSE,
+        last_message_id INTEGER,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        completed_at INTEGER,
+        PRIMARY KEY (user_id, chapter_id)
+    );
+
+    -- Per-user score totals, kept in step with user_progress by triggers
+    CREATE TABLE IF NOT EXISTS user_totals (
+        user_id INTEGER PRIMARY KEY,
+        total_score INTEGER NOT NULL DEFAULT 0
+    );
+
+    -- Help requests
+    CREATE TABLE IF NOT EXISTS help_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        message TEXT NOT NULL,
+        admin_reply TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        replied_at TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    );
+
+    -- Admin settings
+    CREATE TABLE IF NOT EXISTS admin_settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+
+    -- completed_at holds unix seconds; convert rows stamped as text by older
+    -- versions (text sorts above every number, so the range uses the index)
+    UPDATE user_progress SET completed_at = unixepoch(completed_at)
+    WHERE completed_at >= '';
+
+    -- Indexes for the dashboard and leaderboard queries
+    DROP INDEX IF EXISTS idx_up_completed;
+    CREATE INDEX IF NOT EXISTS idx_up_completed_score
+    ON user_progress(completed_at, user_id, score);
+
+    CREATE INDEX IF NOT EXISTS idx_help_pending
+    ON help_requests(created_at) WHERE admin_reply IS NULL;
+
+    CREATE INDEX IF NOT EXISTS idx_up_user_score
+    ON user_progress(user_id, score);
+
+    CREATE INDEX IF NOT EXISTS idx_user_totals_score
+    ON user_totals(total_score);
+
+    CREATE INDEX IF NOT EXISTS idx_help_user
+    ON help_requests(user_id, created_at);
+
+    CREATE INDEX IF NOT EXISTS idx_chapters_subject
+    ON chapters(subject_id);
+
+    CREATE INDEX IF NOT EXISTS idx_quizzes_chapter
+    ON quizzes(chapter_id);
+
+    -- Cascading deletes; triggers also cover databases created before them
+    CREATE TRIGGER IF NOT EXISTS trg_users_delete AFTER DELETE ON users
+    BEGIN
+        DELETE FROM user_progress WHERE user_id = OLD.user_id;
+        DELETE FROM help_requests WHERE user_id = OLD.user_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_subjects_delete AFTER DELETE ON subjects
+    BEGIN
+        DELETE FROM chapters WHERE subject_id = OLD.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_chapters_delete AFTER DELETE ON chapters
+    BEGIN
+        DELETE FROM quizzes WHERE chapter_id = OLD.id;
+        DELETE FROM user_progress WHERE chapter_id = OLD.id;
+    END;
+
+    -- user_totals maintenance; relies on flush_progress upserting in place,
+    -- since INSERT OR REPLACE would skip the delete trigger
+    CREATE TRIGGER IF NOT EXISTS trg_up_insert AFTER INSERT ON user_progress
+    BEGIN
+        INSERT INTO user_totals (user_id, total_score) VALUES (NEW.user_id, NEW.score)
+        ON CONFLICT(user_id) DO UPDATE SET total_score = total_score + excluded.total_score;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_up_update AFTER UPDATE OF score ON user_progress
+    WHEN NEW.score IS NOT OLD.score
+    BEGIN
+        UPDATE user_totals SET total_score = total_score + NEW.score - OLD.score
+        WHERE user_id = NEW.user_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_up_delete AFTER DELETE ON user_progress
+    BEGIN
+        UPDATE user_totals SET total_score = total_score - OLD.score
+        WHERE user_id = OLD.user_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_users_delete_totals AFTER DELETE ON users
+    BEGIN
+        DELETE FROM user_totals WHERE user_id = OLD.user_id;
+    END;
+
+    -- Rebuild once per start so totals can't drift from older databases
+    DELETE FROM user_totals;
+    INSERT INTO user_totals (user_id, total_score)
+    SELECT user_id, COALESCE(SUM(score), 0) FROM user_progress GROUP BY user_id;
+
+    COMMIT;
+"""
+
 # ========================
 # 🗄️ DATABASE MANAGER
 # ========================
 class DatabaseManager:
     def __init__(self, db_path: str):
         self.db_path = db_path
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._readers: List[aiosqlite.Connection] = []
+        self._reader_pool: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._pending_progress: Dict[Tuple[int, int], tuple] = {}
+        # LRU of live attempts; entries still waiting for the flusher are never evicted
+        self._progress_cache: "OrderedDict[Tuple[int, int], QuizProgress]" = OrderedDict()
+        self._progress_event = asyncio.Event()
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._optimize_task: Optional[asyncio.Task] = None
+        self._closed = False
+        # Read-mostly content, invalidated by the admin write methods
+        self._subjects_cache: Optional[List[Tuple[int, str, str]]] = None
+        self._subject_names: Dict[int, str] = {}
+        self._chapters_cache: Dict[int, List[Tuple[int, str]]] = {}
+        self._quiz_cache: Dict[int, List[Question]] = {}
+        # Bumped by every content write so a read that raced it doesn't cache stale rows
+        self._content_version = 0
+        self._dashboard_counts: Optional[Tuple[int, int]] = None
+        self._dashboard_ts = 0.0
+
+    async def _open_connection(self, read_only: bool = False) -> aiosqlite.Connection:
+        if read_only:
+            db = await aiosqlite.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        else:
+            db = await aiosqlite.connect(self.db_path)
+        db.row_factory = aiosqlite.Row
+        # Per-connection settings; journal_mode=WAL persists in the file and is set once.
+        # synchronous=NORMAL is durable against app crashes under WAL, only a power
+        # loss can roll back the last commits.
+        await db.execute_fetchall("PRAGMA busy_timeout=5000")
+        await db.execute_fetchall("PRAGMA synchronous=NORMAL")
+        await db.execute_fetchall("PRAGMA temp_store=MEMORY")
+        await db.execute_fetchall("PRAGMA cache_size=-64000")
+        await db.execute_fetchall("PRAGMA mmap_size=268435456")
+        return db
+
+    @asynccontextmanager
+    async def _acquire(self):
+        # Reads run on a pool of connections; under WAL they never block the writer
+        if self._closed:
+            raise aiosqlite.ProgrammingError("Database manager is closed")
+        if Config.DB_EXCLUSIVE:
+            async with self._write() as db:
+                yield db
+            return
+        db = await self._reader_pool.get()
+        if self._closed:
+            # Woken by a reader handed back during close(); pass it on to close() instead
+            self._reader_pool.put_nowait(db)
+            raise aiosqlite.ProgrammingError("Database manager is closed")
+        try:
+            yield db
+        finally:
+            self._reader_pool.put_nowait(db)
+
+    @asynccontextmanager
+    async def _write(self):
+        # Writes share one connection; the lock keeps their transactions from interleaving
+        async with self._write_lock:
+            try:
+                yield self._conn
+            except BaseException:
+                # Never leave a half-done transaction for the next writer's commit to persist
+                await self._conn.rollback()
+                raise
 
     async def initialize(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            # Users table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    username TEXT,
-                    profile_confirmed BOOLEAN DEFAULT FALSE,
-                    joined_channel BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Subjects and chapters
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS subjects (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT UNIQUE NOT NULL,
-                    description TEXT
-                )
-            """)
-            
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS chapters (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    subject_id INTEGER,
-                    name TEXT NOT NULL,
-                    FOREIGN KEY (subject_id) REFERENCES subjects(id)
-                )
-            """)
-            
-            # Quizzes
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS quizzes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chapter_id INTEGER,
-                    questions TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (chapter_id) REFERENCES chapters(id)
-                )
-            """)
-            
-            # User progress
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_progress (
-                    user_id INTEGER,
-                    chapter_id INTEGER,
-                    current_index INTEGER DEFAULT 0,
-                    score INTEGER DEFAULT 0,
-                    answers TEXT DEFAULT '[]',
-                    completed BOOLEAN DEFAULT FALSE,
-                    last_message_id INTEGER,
-                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    completed_at TIMESTAMP,
-                    PRIMARY KEY (user_id, chapter_id)
-                )
-            """)
-            
-            # Help requests
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS help_requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    message TEXT NOT NULL,
-                    admin_reply TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    replied_at TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            # Admin settings
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS admin_settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
-            """)
-            
-            await db.commit()
+        self._conn = await self._open_connection()
+        db = self._conn
+        if Config.DB_EXCLUSIVE:
+            # Must precede the switch to WAL so the wal-index lives in heap memory
+            await db.execute_fetchall("PRAGMA locking_mode=EXCLUSIVE")
+        # WAL relies on shared memory, so DB_FILE must live on a local disk (not NFS).
+        # PRAGMAs go through execute_fetchall so no statement is left open: an unfinished
+        # one makes the COMMIT at the end of _SCHEMA fail with "SQL statements in progress"
+        await db.execute_fetchall("PRAGMA journal_mode=WAL")
+        # One script, one transaction for the whole schema and its migrations
+        await db.executescript(_SCHEMA)
+        # Refresh planner statistics so the schema indexes get picked as tables grow
+        await db.execute_fetchall("PRAGMA optimize")
+        
+        for _ in range(0 if Config.DB_EXCLUSIVE else Config.DB_READERS):
+            reader = await self._open_connection(read_only=True)
+            self._readers.append(reader)
+            self._reader_pool.put_nowait(reader)
+        self._flusher_task = asyncio.create_task(self._progress_flusher())
+        self._optimize_task = asyncio.create_task(self._periodic_optimize())
+
+    @property
+    def background_tasks(self) -> List[asyncio.Task]:
+        return [task for task in (self._flusher_task, self._optimize_task) if task is not None]
+
+    async def close(self):
+        self._closed = True
+        if self._flusher_task is not None:
+            self._flusher_task.cancel()
+            self._flusher_task = None
+        if self._optimize_task is not None:
+            self._optimize_task.cancel()
+            self._optimize_task = None
+        # Wait for readers still in use to be handed back, but never let a stuck query block shutdown
+        returned = 0
+        try:
+            for _ in self._readers:
+                await asyncio.wait_for(self._reader_pool.get(), timeout=Config.SHUTDOWN_GRACE)
+                returned += 1
+        except asyncio.TimeoutError:
+            logging.warning("Closing %d reader(s) still in use", len(self._readers) - returned)
+        for reader in self._readers:
+            await reader.close()
+        self._readers.clear()
+        # initialize() may have failed part-way; close whatever it managed to open
+        if self._conn is not None:
+            try:
+                await self.flush_progress()
+                await self._conn.execute_fetchall("PRAGMA optimize")
+            finally:
+                await self._conn.close()
+                self._conn = None
 
     async def save_user(self, user: User):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("""
                 INSERT OR REPLACE INTO users 
                 (user_id, name, username, profile_confirmed, joined_channel)
@@ -155,33 +498,65 @@ class DatabaseManager:
             """, (user.user_id, user.name, user.username, user.profile_confirmed, user.joined_channel))
             await db.commit()
 
+    async def upsert_user(self, user: User, in_channel: bool) -> bool:
+        async with self._write() as db:
+            rows = await db.execute_fetchall("""
+                INSERT INTO users (user_id, name, username, joined_channel)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    name = excluded.name,
+                    username = excluded.username,
+                    joined_channel = excluded.joined_channel
+                RETURNING profile_confirmed
+            """, (user.user_id, user.name, user.username, in_channel))
+            await db.commit()
+            return bool(rows[0][0]) if rows else False
+
     async def get_user(self, user_id: int) -> Optional[User]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
+        async with self._acquire() as db:
+            rows = await db.execute_fetchall(
                 "SELECT name, username, profile_confirmed, joined_channel FROM users WHERE user_id = ?",
                 (user_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return User(
-                        user_id=user_id,
-                        name=row[0],
-                        username=row[1],
-                        profile_confirmed=bool(row[2]),
-                        joined_channel=bool(row[3])
-                    )
-                return None
+            )
+        row = rows[0] if rows else None
+        if row:
+            return User(
+                user_id=user_id,
+                name=row["name"],
+                username=row["username"],
+                profile_confirmed=bool(row["profile_confirmed"]),
+                joined_channel=bool(row["joined_channel"])
+            )
+        return None
 
     async def update_user_channel_status(self, user_id: int, joined: bool):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute(
                 "UPDATE users SET joined_channel = ? WHERE user_id = ?",
                 (joined, user_id)
             )
             await db.commit()
 
+    async def update_channel_statuses(self, statuses: List[Tuple[bool, int]]):
+        async with self._write() as db:
+            await db.executemany(
+                "UPDATE users SET joined_channel = ? WHERE user_id = ?",
+                statuses
+            )
+            await db.commit()
+
+    async def get_channel_status(self, user_id: int) -> Optional[bool]:
+        async with self._acquire() as db:
+            rows = await db.execute_fetchall("SELECT joined_channel FROM users WHERE user_id = ?", (user_id,))
+        return bool(rows[0][0]) if rows else None
+
+    async def get_user_ids(self) -> List[int]:
+        async with self._acquire() as db:
+            rows = await db.execute_fetchall("SELECT user_id FROM users")
+        return [row[0] for row in rows]
+
     async def confirm_user_profile(self, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute(
                 "UPDATE users SET profile_confirmed = TRUE WHERE user_id = ?",
                 (user_id,)
@@ -190,202 +565,338 @@ class DatabaseManager:
 
     # Admin methods
     async def add_subject(self, name: str, description: str = ""):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute(
                 "INSERT OR IGNORE INTO subjects (name, description) VALUES (?, ?)",
                 (name, description)
             )
             await db.commit()
+            self._subjects_cache = None
+            self._content_version += 1
 
     async def add_chapter(self, subject_name: str, chapter_name: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT id FROM subjects WHERE name = ?", (subject_name,)) as cursor:
-                subject_row = await cursor.fetchone()
-                if subject_row:
-                    await db.execute(
-                        "INSERT OR IGNORE INTO chapters (subject_id, name) VALUES (?, ?)",
-                        (subject_row[0], chapter_name)
-                    )
+        # chapters has no unique key on (subject_id, name), so skip existing ones explicitly
+        async with self._write() as db:
+            rows = await db.execute_fetchall("""
+                INSERT INTO chapters (subject_id, name)
+                SELECT s.id, ? FROM subjects s
+                WHERE s.name = ? AND NOT EXISTS (
+                    SELECT 1 FROM chapters c WHERE c.subject_id = s.id AND c.name = ?
+                )
+                RETURNING subject_id
+            """, (chapter_name, subject_name, chapter_name))
             await db.commit()
+            if rows:
+                self._chapters_cache.pop(rows[0][0], None)
+                self._content_version += 1
 
     async def save_quiz(self, subject_name: str, chapter_name: str, questions: List[Question]):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT id FROM subjects WHERE name = ?", (subject_name,)) as cursor:
-                subject_row = await cursor.fetchone()
-                if not subject_row:
-                    return False
-                
-            async with db.execute(
-                "SELECT id FROM chapters WHERE subject_id = ? AND name = ?", 
-                (subject_row[0], chapter_name)
-            ) as cursor:
-                chapter_row = await cursor.fetchone()
-                if not chapter_row:
-                    return False
-
-            questions_json = json.dumps([{
-                'question': q.question,
-                'options': q.options,
-                'correct': q.correct,
-                'explanation': q.explanation
-            } for q in questions])
-
-            await db.execute(
-                "INSERT OR REPLACE INTO quizzes (chapter_id, questions) VALUES (?, ?)",
-                (chapter_row[0], questions_json)
-            )
+        # orjson serializes the Question dataclasses natively, straight to bytes
+        questions_blob = orjson.dumps(questions)
+        
+        async with self._write() as db:
+            rows = await db.execute_fetchall("""
+                INSERT INTO quizzes (chapter_id, questions)
+                SELECT c.id, ? FROM chapters c
+                JOIN subjects s ON s.id = c.subject_id
+                WHERE s.name = ? AND c.name = ?
+                ORDER BY c.id LIMIT 1
+                RETURNING id, chapter_id
+            """, (questions_blob, subject_name, chapter_name))
+            if rows:
+                quiz_id, chapter_id = rows[0]
+                # quizzes has no unique key on chapter_id, so drop the old quiz explicitly
+                await db.execute(
+                    "DELETE FROM quizzes WHERE chapter_id = ? AND id < ?",
+                    (chapter_id, quiz_id)
+                )
             await db.commit()
+            if not rows:
+                return False
+            self._quiz_cache.pop(chapter_id, None)
+            self._content_version += 1
             return True
 
     async def get_subjects(self) -> List[Tuple[int, str, str]]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT id, name, description FROM subjects") as cursor:
-                return await cursor.fetchall()
+        if self._subjects_cache is not None:
+            return self._subjects_cache
+        version = self._content_version
+        async with self._acquire() as db:
+            subjects = await db.execute_fetchall("SELECT id, name, description FROM subjects")
+        if version == self._content_version:
+            self._subjects_cache = subjects
+            self._subject_names = {subject_id: name for subject_id, name, _ in subjects}
+        return subjects
+
+    async def get_subject_name(self, subject_id: int) -> Optional[str]:
+        subjects = await self.get_subjects()
+        if subjects is not self._subjects_cache:
+            return next((name for sid, name, _ in subjects if sid == subject_id), None)
+        return self._subject_names.get(subject_id)
 
     async def get_chapters(self, subject_id: int) -> List[Tuple[int, str]]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
+        if subject_id in self._chapters_cache:
+            return self._chapters_cache[subject_id]
+        version = self._content_version
+        async with self._acquire() as db:
+            chapters = await db.execute_fetchall(
                 "SELECT id, name FROM chapters WHERE subject_id = ?", 
                 (subject_id,)
-            ) as cursor:
-                return await cursor.fetchall()
+            )
+        if version == self._content_version:
+            self._chapters_cache[subject_id] = chapters
+        return chapters
 
     async def get_quiz(self, chapter_id: int) -> Optional[List[Question]]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
+        if chapter_id in self._quiz_cache:
+            return self._quiz_cache[chapter_id]
+        version = self._content_version
+        async with self._acquire() as db:
+            rows = await db.execute_fetchall(
                 "SELECT questions FROM quizzes WHERE chapter_id = ?", 
                 (chapter_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    data = json.loads(row[0])
-                    return [Question(**q) for q in data]
-                return None
+            )
+        row = rows[0] if rows else None
+        if row:
+            quiz = [Question(**q) for q in orjson.loads(row[0])]
+            if version == self._content_version:
+                self._quiz_cache[chapter_id] = quiz
+            return quiz
+        return None
 
     async def get_progress(self, user_id: int, chapter_id: int) -> QuizProgress:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
+        # Live progress objects stay in memory; SQLite is only read on first access
+        cached = self._progress_cache.get((user_id, chapter_id))
+        if cached is not None:
+            self._progress_cache.move_to_end((user_id, chapter_id))
+            return cached
+        
+        async with self._acquire() as db:
+            rows = await db.execute_fetchall(
                 "SELECT current_index, score, answers, completed, last_message_id FROM user_progress WHERE user_id = ? AND chapter_id = ?",
                 (user_id, chapter_id)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return QuizProgress(
-                        user_id=user_id,
-                        chapter_id=chapter_id,
-                        current_index=row[0],
-                        score=row[1],
-                        answers=json.loads(row[2]),
-                        completed=bool(row[3]),
-                        last_message_id=row[4]
-                    )
-                return QuizProgress(user_id=user_id, chapter_id=chapter_id, current_index=0, score=0, answers=[])
+            )
+        row = rows[0] if rows else None
+        if row:
+            progress = QuizProgress(
+                user_id=user_id,
+                chapter_id=chapter_id,
+                current_index=row["current_index"],
+                score=row["score"],
+                answers=orjson.loads(row["answers"]),
+                completed=bool(row["completed"]),
+                last_message_id=row["last_message_id"]
+            )
+        else:
+            progress = QuizProgress(user_id=user_id, chapter_id=chapter_id, current_index=0, score=0, answers=[])
+        return self._progress_cache.setdefault((user_id, chapter_id), progress)
 
     async def save_progress(self, user_id: int, chapter_id: int, progress: QuizProgress):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT OR REPLACE INTO user_progress 
-                (user_id, chapter_id, current_index, score, answers, completed, last_message_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                user_id, chapter_id, progress.current_index, 
-                progress.score, json.dumps(progress.answers), 
-                progress.completed, progress.last_message_id
-            ))
+        # Queued for the background flusher; get_progress serves the live object
+        self._progress_cache[(user_id, chapter_id)] = progress
+        self._progress_cache.move_to_end((user_id, chapter_id))
+        self._pending_progress[(user_id, chapter_id)] = (
+            user_id, chapter_id, progress.current_index, 
+            progress.score, orjson.dumps(progress.answers), 
+            progress.completed, progress.last_message_id
+        )
+        self._progress_event.set()
+
+    async def flush_progress(self):
+        self._progress_event.clear()
+        if not self._pending_progress:
+            return
+        batch = dict(self._pending_progress)
+        async with self._write() as db:
+            # completed_at is stamped when a quiz first completes and cleared on retake,
+            # which is what the weekly leaderboard windows on
+            await db.executemany("""
+                INSERT INTO user_progress 
+                (user_id, chapter_id, current_index, score, answers, completed, last_message_id, completed_at)
+                VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, CASE WHEN ?6 THEN unixepoch() END)
+                ON CONFLICT(user_id, chapter_id) DO UPDATE SET
+                    current_index = excluded.current_index,
+                    score = excluded.score,
+                    answers = excluded.answers,
+                    completed = excluded.completed,
+                    last_message_id = excluded.last_message_id,
+                    completed_at = CASE
+                        WHEN NOT excluded.completed THEN NULL
+                        WHEN user_progress.completed THEN user_progress.completed_at
+                        ELSE excluded.completed_at
+                    END
+            """, list(batch.values()))
             await db.commit()
+        # Keep rows that were re-queued while the batch was being written
+        for key, row in batch.items():
+            if self._pending_progress.get(key) is row:
+                del self._pending_progress[key]
+        self._trim_progress_cache()
+
+    def _trim_progress_cache(self):
+        excess = len(self._progress_cache) - Config.PROGRESS_CACHE_SIZE
+        if excess <= 0:
+            return
+        idle = (key for key in self._progress_cache if key not in self._pending_progress)
+        for key in list(islice(idle, excess)):
+            del self._progress_cache[key]
+
+    def release_progress(self, user_id: int, chapter_id: int):
+        # Drops a finished attempt from memory once it is safely in SQLite
+        if (user_id, chapter_id) not in self._pending_progress:
+            self._progress_cache.pop((user_id, chapter_id), None)
+
+    async def _progress_flusher(self):
+        while True:
+            await self._progress_event.wait()
+            await asyncio.sleep(Config.PROGRESS_FLUSH_INTERVAL)
+            try:
+                await self.flush_progress()
+            except aiosqlite.Error as e:
+                logging.error("Progress flush error: %s", e)
+                # The batch is still pending; retry it after the next interval
+                self._progress_event.set()
+
+    async def _periodic_optimize(self):
+        while True:
+            await asyncio.sleep(Config.DB_OPTIMIZE_INTERVAL)
+            try:
+                async with self._write() as db:
+                    await db.execute_fetchall("PRAGMA optimize")
+            except aiosqlite.Error as e:
+                logging.error("PRAGMA optimize error: %s", e)
 
     async def get_user_total_score(self, user_id: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT SUM(score) FROM user_progress WHERE user_id = ?",
+        async with self._acquire() as db:
+            rows = await db.execute_fetchall(
+                "SELECT total_score FROM user_totals WHERE user_id = ?",
                 (user_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                return row[0] if row[0] else 0
+            )
+        return rows[0][0] if rows else 0
 
     async def get_top_scorers_weekly(self, limit: int = 3) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
-            async with db.execute("""
-                SELECT u.name, u.username, SUM(up.score) as total_score
+        week_ago = int(time.time()) - 7 * 86400
+        async with self._acquire() as db:
+            rows = await db.execute_fetchall("""
+                SELECT u.name, u.username, SUM(up.score) as total_score,
+                       RANK() OVER (ORDER BY SUM(up.score) DESC) as rank
                 FROM user_progress up
                 JOIN users u ON u.user_id = up.user_id
                 WHERE up.completed_at >= ?
                 GROUP BY u.user_id
-                ORDER BY total_score DESC
+                ORDER BY rank, u.user_id
                 LIMIT ?
-            """, (week_ago, limit)) as cursor:
-                rows = await cursor.fetchall()
-                return [
-                    {"name": row[0], "username": row[1], "total_score": row[2], "rank": idx+1}
-                    for idx, row in enumerate(rows)
-                ]
-
-    async def get_all_scores(self) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("""
-                SELECT u.name, u.username, SUM(up.score) as total_score
-                FROM user_progress up
-                JOIN users u ON u.user_id = up.user_id
-                GROUP BY u.user_id
-                ORDER BY total_score ASC
-            """) as cursor:
-                rows = await cursor.fetchall()
-                return [
-                    {"name": row[0], "username": row[1], "total_score": row[2], "rank": idx+1}
-                    for idx, row in enumerate(rows)
-                ]
+            """, (week_ago, limit))
+        return [dict(row) for row in rows]
+
+    async def get_user_weekly_rank(self, user_id: int) -> Optional[int]:
+        week_ago = int(time.time()) - 7 * 86400
+        async with self._acquire() as db:
+            rows = await db.execute_fetchall("""
+                WITH ranked AS (
+                    SELECT up.user_id, RANK() OVER (ORDER BY SUM(up.score) DESC) AS user_rank
+                    FROM user_progress up
+                    JOIN users u ON u.user_id = up.user_id
+                    WHERE up.completed_at >= ?
+                    GROUP BY up.user_id
+                )
+                SELECT user_rank FROM ranked WHERE user_id = ?
+            """, (week_ago, user_id))
+        return rows[0][0] if rows else None
+
+    async def get_all_scores(self, offset: int = 0, limit: int = -1) -> List[Dict]:
+        async with self._acquire() as db:
+            rows = await db.execute_fetchall("""
+                SELECT u.name, u.username, t.total_score,
+                       ROW_NUMBER() OVER (ORDER BY t.total_score DESC) as rank
+                FROM user_totals t
+                JOIN users u ON u.user_id = t.user_id
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            """, (limit, offset))
+        return [dict(row) for row in rows]
+
+    async def get_recent_users(self, limit: int = 10) -> List[Tuple[int, str, str]]:
+        async with self._acquire() as db:
+            return await db.execute_fetchall(
+                "SELECT user_id, name, username FROM users ORDER BY user_id DESC LIMIT ?",
+                (limit,)
+            )
+
+    async def get_dashboard_counts(self, max_age: float = Config.DASHBOARD_CACHE_TTL) -> Tuple[int, int]:
+        if self._dashboard_counts and time.monotonic() - self._dashboard_ts < max_age:
+            return self._dashboard_counts
+        async with self._acquire() as db:
+            rows = await db.execute_fetchall("""
+                SELECT
+                    (SELECT COUNT(*) FROM users),
+                    (SELECT COUNT(*) FROM help_requests WHERE admin_reply IS NULL)
+            """)
+        total_users, pending_help = rows[0]
+        self._dashboard_counts = (total_users or 0, pending_help or 0)
+        self._dashboard_ts = time.monotonic()
+        return self._dashboard_counts
 
     async def delete_user(self, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        for key in [key for key in self._pending_progress if key[0] == user_id]:
+            del self._pending_progress[key]
+        for key in [key for key in self._progress_cache if key[0] == user_id]:
+            del self._progress_cache[key]
+        async with self._write() as db:
+            # trg_users_delete removes the user's progress and help requests
             await db.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-            await db.execute("DELETE FROM user_progress WHERE user_id = ?", (user_id,))
-            await db.execute("DELETE FROM help_requests WHERE user_id = ?", (user_id,))
             await db.commit()
+            self._dashboard_ts = 0.0
 
     # Help request methods
     async def create_help_request(self, user_id: int, message: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute(
                 "INSERT INTO help_requests (user_id, message) VALUES (?, ?)",
                 (user_id, message)
             )
             await db.commit()
+            self._dashboard_ts = 0.0
 
-    async def get_pending_help_requests(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("""
+    async def get_pending_help_requests(self, offset: int = 0, limit: int = -1):
+        async with self._acquire() as db:
+            return await db.execute_fetchall("""
                 SELECT hr.id, u.name, u.user_id, hr.message, hr.created_at 
                 FROM help_requests hr
                 JOIN users u ON u.user_id = hr.user_id
                 WHERE hr.admin_reply IS NULL
                 ORDER BY hr.created_at DESC
-            """) as cursor:
-                return await cursor.fetchall()
+                LIMIT ? OFFSET ?
+            """, (limit, offset))
 
-    async def reply_to_help_request(self, request_id: int, admin_reply: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE help_requests SET admin_reply = ?, replied_at = CURRENT_TIMESTAMP WHERE id = ?",
+    async def reply_to_help_request(self, request_id: int, admin_reply: str) -> Optional[int]:
+        async with self._write() as db:
+            rows = await db.execute_fetchall(
+                "UPDATE help_requests SET admin_reply = ?, replied_at = CURRENT_TIMESTAMP WHERE id = ? RETURNING user_id",
                 (admin_reply, request_id)
             )
             await db.commit()
+            self._dashboard_ts = 0.0
+            return rows[0][0] if rows else None
 
-    async def get_user_help_requests(self, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("""
+    async def get_user_help_requests(self, user_id: int, offset: int = 0, limit: int = -1):
+        async with self._acquire() as db:
+            return await db.execute_fetchall("""
                 SELECT message, admin_reply, created_at, replied_at 
                 FROM help_requests 
                 WHERE user_id = ? 
                 ORDER BY created_at DESC
-            """, (user_id,)) as cursor:
-                return await cursor.fetchall()
+                LIMIT ? OFFSET ?
+            """, (user_id, limit, offset))
 
 # ========================
 # 🎮 QUIZ SERVICE
 # ========================
+_REQUIRED_QUESTION_FIELDS = frozenset(('question', 'options', 'correct', 'explanation'))
+
 class QuizService:
     @staticmethod
+    @lru_cache(maxsize=256)
     def create_progress_bar(current: int, total: int, width: int = 10) -> str:
         percentage = min(100, (current / total) * 100)
         filled = int((percentage / 100) * width)
@@ -393,22 +904,32 @@ class QuizService:
         return f"{bar} {percentage:.0f}%"
 
     @staticmethod
-    def validate_quiz_data(quiz_data: dict) -> bool:
+    def validate_question(question: dict) -> bool:
+        if not isinstance(question, dict) or not _REQUIRED_QUESTION_FIELDS <= question.keys():
+            return False
+        options = question['options']
+        if not isinstance(options, list) or len(options) < 2:
+            return False
         try:
-            if not isinstance(quiz_data, list):
-                return False
-            for question in quiz_data:
-                required_fields = ['question', 'options', 'correct', 'explanation']
-                if not all(field in question for field in required_fields):
-                    return False
-                if not isinstance(question['options'], list) or len(question['options']) < 2:
-                    return False
-                if not 0 <= question['correct'] < len(question['options']):
-                    return False
-            return True
-        except:
+            return 0 <= question['correct'] < len(options)
+        except TypeError:
             return False
 
+    @classmethod
+    def parse_questions(cls, quiz_data) -> Optional[List[Question]]:
+        if not isinstance(quiz_data, list):
+            return None
+        questions = []
+        for q in quiz_data:
+            if not cls.validate_question(q):
+                return None
+            questions.append(Question(**q))
+        return questions
+
+    @classmethod
+    def load_questions(cls, raw: bytes) -> Optional[List[Question]]:
+        return cls.parse_questions(orjson.loads(raw))
+
 # ========================
 # 🤖 MODERN QUIZ BOT
 # ========================
@@ -418,12 +939,109 @@ class ModernQuizBot:
         self.db = DatabaseManager(Config.DB_FILE)
         self.quiz_service = QuizService()
         self.admin_id = admin_id
-        self.user_states = {}
+        self._states: Dict[int, StateCtx] = {}
+        self._state_locks: Dict[int, StateLock] = {}
+        self._send_sem = asyncio.Semaphore(Config.SEND_CONCURRENCY)
+        self._next_send_at = 0.0
+        self._chat_blocked_until: Dict[int, float] = {}
+        self._group_sends: Dict[int, Deque[float]] = defaultdict(lambda: deque(maxlen=Config.GROUP_SEND_LIMIT))
+        self._static_markups = self._build_static_markups()
+        self._member_check_task: Optional[asyncio.Task] = None
+        self._deleted_msgs: "OrderedDict[Tuple[int, int], None]" = OrderedDict()
+        self._question_markups: Dict[Tuple[int, int], Tuple[Question, InlineKeyboardMarkup]] = {}
+        self._membership_cache: Dict[int, float] = {}
+        self._membership_inflight: Dict[int, asyncio.Future] = {}
+        self._update_sem = asyncio.Semaphore(Config.UPDATE_CONCURRENCY)
+        self._update_tasks = set()
+        self._build_callback_routes()
+        self._build_menu_routes()
         self._register_handlers()
 
     async def initialize(self):
         await self.db.initialize()
 
+    @staticmethod
+    def _build_static_markups() -> Dict[str, Union[InlineKeyboardMarkup, ReplyKeyboardMarkup]]:
+        main_menu = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+        main_menu.add(
+            KeyboardButton("🎯 Take Quiz"),
+            KeyboardButton("📊 My Profile"),
+            KeyboardButton("🏆 Top Scorers"),
+            KeyboardButton("💬 Help & Support")
+        )
+        
+        channel_requirement = InlineKeyboardMarkup()
+        channel_link = Config.MANDATORY_CHANNEL.lstrip('@')
+        channel_requirement.add(InlineKeyboardButton("📢 Join Channel", url=f"https://t.me/{channel_link}"))
+        channel_requirement.add(InlineKeyboardButton("✅ I've Joined", callback_data="check_channel"))
+        
+        profile_confirmation = InlineKeyboardMarkup()
+        profile_confirmation.add(InlineKeyboardButton("✅ Confirm My Profile", callback_data="confirm_profile"))
+        
+        help_options = InlineKeyboardMarkup()
+        help_options.add(InlineKeyboardButton("📝 Ask Question", callback_data="ask_question"))
+        help_options.add(InlineKeyboardButton("📋 My Questions", callback_data="my_questions"))
+        help_options.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
+        
+        quiz_complete = InlineKeyboardMarkup()
+        quiz_complete.add(InlineKeyboardButton("📊 Profile", callback_data="view_profile"))
+        quiz_complete.add(InlineKeyboardButton("🎯 Another", callback_data="back_subjects"))
+        quiz_complete.add(InlineKeyboardButton("🏠 Menu", callback_data="main_menu"))
+        
+        user_profile = InlineKeyboardMarkup()
+        user_profile.add(InlineKeyboardButton("🔄 Refresh", callback_data="view_profile"))
+        user_profile.add(InlineKeyboardButton("🏠 Menu", callback_data="main_menu"))
+        
+        top_scorers = InlineKeyboardMarkup()
+        top_scorers.add(InlineKeyboardButton("🔄 Refresh", callback_data="top_scorers"))
+        top_scorers.add(InlineKeyboardButton("🏠 Menu", callback_data="main_menu"))
+        
+        admin_back = InlineKeyboardMarkup()
+        admin_back.add(_ADMIN_BACK_BUTTON)
+        
+        admin_dashboard = InlineKeyboardMarkup(row_width=2)
+        admin_dashboard.add(
+            InlineKeyboardButton("📤 Upload Quiz", callback_data="admin_upload"),
+            InlineKeyboardButton("📊 View Scores", callback_data="admin_scores")
+        )
+        admin_dashboard.add(
+            InlineKeyboardButton("➕ Add Subject", callback_data="admin_add_subject"),
+            InlineKeyboardButton("📖 Add Chapter", callback_data="admin_add_chapter")
+        )
+        admin_dashboard.add(
+            InlineKeyboardButton("👥 Manage Users", callback_data="admin_manage_users"),
+            InlineKeyboardButton("📩 Help Requests", callback_data="admin_help_requests")
+        )
+        admin_dashboard.add(InlineKeyboardButton("🔄 Check Members", callback_data="admin_check_members"))
+        
+        admin_upload = InlineKeyboardMarkup()
+        admin_upload.add(
+            InlineKeyboardButton("➕ Add Subject", callback_data="admin_add_subject"),
+            InlineKeyboardButton("📖 Add Chapter", callback_data="admin_add_chapter")
+        )
+        admin_upload.add(_ADMIN_BACK_BUTTON)
+        
+        admin_settings = InlineKeyboardMarkup(row_width=2)
+        admin_settings.add(
+            InlineKeyboardButton("📊 Stats", callback_data="admin_stats"),
+            InlineKeyboardButton("🔧 Tools", callback_data="admin_tools")
+        )
+        admin_settings.add(_ADMIN_BACK_BUTTON)
+        
+        return {
+            'main_menu': main_menu,
+            'channel_requirement': channel_requirement,
+            'profile_confirmation': profile_confirmation,
+            'help_options': help_options,
+            'quiz_complete': quiz_complete,
+            'user_profile': user_profile,
+            'top_scorers': top_scorers,
+            'admin_back': admin_back,
+            'admin_dashboard': admin_dashboard,
+            'admin_upload': admin_upload,
+            'admin_settings': admin_settings,
+        }
+
     def _register_handlers(self):
         self.bot.message_handler(commands=['start'])(self._start_handler)
         self.bot.message_handler(commands=['help'])(self._help_handler)
@@ -431,21 +1049,175 @@ class ModernQuizBot:
         self.bot.message_handler(content_types=['text'])(self._text_handler)
         self.bot.message_handler(content_types=['document'])(self._document_handler)
         self.bot.callback_query_handler(func=lambda call: True)(self._callback_handler)
+        self.bot.chat_member_handler()(self._on_chat_member)
 
-    async def _check_channel_membership(self, user_id: int) -> bool:
+    async def _on_chat_member(self, update: ChatMemberUpdated):
+        if (update.chat.username or '').lower() != Config.MANDATORY_CHANNEL.lstrip('@').lower():
+            return
+        member = update.new_chat_member
+        in_channel = member.status in ['member', 'administrator', 'creator']
+        if in_channel:
+            self._membership_cache[member.user.id] = time.monotonic()
+        else:
+            self._membership_cache.pop(member.user.id, None)
+        await self.db.update_user_channel_status(member.user.id, in_channel)
+
+    async def _throttle(self, chat_id: int):
+        # Pace sends under Telegram's ~30 msg/s global and 20 msg/min per-group limits
+        now = time.monotonic()
+        blocked_until = self._chat_blocked_until.get(chat_id, 0.0)
+        if blocked_until <= now:
+            self._chat_blocked_until.pop(chat_id, None)
+        send_at = max(now, self._next_send_at, blocked_until)
+        if chat_id < 0:
+            sent = self._group_sends[chat_id]
+            if len(sent) == sent.maxlen:
+                send_at = max(send_at, sent[0] + Config.GROUP_SEND_PERIOD)
+            sent.append(send_at)
+        self._next_send_at = max(self._next_send_at, now) + 1 / Config.GLOBAL_SEND_RATE
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+    @asynccontextmanager
+    async def _state_lock(self, user_id: int):
+        # Serializes one user's handlers; the lock is dropped once nobody holds or awaits it
+        entry = self._state_locks.get(user_id)
+        if entry is None:
+            entry = self._state_locks[user_id] = StateLock()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._state_locks[user_id]
+
+    def _get_state(self, user_id: int) -> UserState:
+        ctx = self._states.get(user_id)
+        return ctx.state if ctx else UserState.IDLE
+
+    async def _safe_send(self, chat_id: int, text: str, **kwargs) -> Message:
+        for attempt in range(Config.SEND_RETRIES):
+            await self._throttle(chat_id)
+            try:
+                async with self._send_sem:
+                    started = time.perf_counter()
+                    msg = await self.bot.send_message(chat_id, text, **kwargs)
+                logging.debug("send_message to %s took %.1f ms", chat_id, (time.perf_counter() - started) * 1000)
+                return msg
+            except ApiTelegramException as e:
+                if e.error_code != 429 or attempt == Config.SEND_RETRIES - 1:
+                    raise
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                # Only this chat backs off; other chats keep their send slots
+                self._chat_blocked_until[chat_id] = time.monotonic() + max(retry_after, 2 ** attempt)
+
+    async def _edit_or_send(self, chat_id: int, message_id: Optional[int], text: str, **kwargs) -> int:
+        # Editing in place costs one API call instead of a delete plus a send; returns the shown message's id
+        if message_id:
+            for attempt in range(Config.SEND_RETRIES):
+                await self._throttle(chat_id)
+                try:
+                    async with self._send_sem:
+                        await self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)
+                    return message_id
+                except ApiTelegramException as e:
+                    description = (e.description or "").lower()
+                    if "message is not modified" in description:
+                        return message_id
+                    if e.error_code == 429 and attempt < Config.SEND_RETRIES - 1:
+                        retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                        self._chat_blocked_until[chat_id] = time.monotonic() + max(retry_after, 2 ** attempt)
+                        continue
+                    # Only a message that is gone or too old to edit falls back to a fresh send
+                    if e.error_code != 400 or not (
+                        "message to edit not found" in description or "message can't be edited" in description
+                    ):
+                        raise
+                    logging.debug("Edit of message %s failed, sending instead: %s", message_id, e)
+                    break
+        msg = await self._safe_send(chat_id, text, **kwargs)
+        return msg.message_id
+
+    async def _check_channel_membership(self, user_id: int, use_cache: bool = True) -> bool:
+        # Only positive results are cached so "I've Joined" is re-checked right away
+        cached_at = self._membership_cache.get(user_id)
+        if use_cache and cached_at and time.monotonic() - cached_at < Config.MEMBERSHIP_CACHE_TTL:
+            return True
+        
+        # Joins and leaves are tracked from chat_member updates; negatives still ask Telegram
+        if use_cache and await self.db.get_channel_status(user_id):
+            self._membership_cache[user_id] = time.monotonic()
+            return True
+        
+        inflight = self._membership_inflight.get(user_id)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._membership_inflight[user_id] = future
+        in_channel = False
         try:
             channel_username = Config.MANDATORY_CHANNEL.lstrip('@')
             member = await self.bot.get_chat_member(f"@{channel_username}", user_id)
-            return member.status in ['member', 'administrator', 'creator']
+            in_channel = member.status in ['member', 'administrator', 'creator']
         except Exception as e:
-            logging.error(f"Channel check error: {e}")
-            return False
+            logging.error("Channel check error: %s", e)
+        finally:
+            self._membership_inflight.pop(user_id, None)
+            future.set_result(in_channel)
+        
+        if in_channel:
+            self._membership_cache[user_id] = time.monotonic()
+        else:
+            self._membership_cache.pop(user_id, None)
+        return in_channel
 
-    async def _cleanup_previous_message(self, chat_id: int, message_id: int):
+    async def force_check_all(self) -> Tuple[int, int]:
+        user_ids = await self.db.get_user_ids()
+        sem = asyncio.Semaphore(Config.MEMBER_CHECK_CONCURRENCY)
+        
+        async def check(user_id: int) -> Tuple[bool, int]:
+            async with sem:
+                return await self._check_channel_membership(user_id, use_cache=False), user_id
+        
+        statuses = await asyncio.gather(*(check(user_id) for user_id in user_ids))
+        await self.db.update_channel_statuses(statuses)
+        joined = sum(1 for in_channel, _ in statuses if in_channel)
+        return joined, len(statuses)
+
+    async def _run_member_check(self, chat_id: int, message_id: int):
+        try:
+            joined, total = await self.force_check_all()
+            text = f"✅ Channel check done: {joined}/{total} users joined."
+        except Exception as e:
+            logging.error("Member check error: %s", e)
+            text = "❌ Channel check failed!"
+        try:
+            await self._edit_or_send(chat_id, message_id, text)
+        except (ApiTelegramException, asyncio.TimeoutError) as e:
+            logging.debug("Member check result edit failed: %s", e)
+
+    async def _cleanup_previous_message(self, chat_id: int, message_id: int, sent_at: Optional[int] = None):
+        key = (chat_id, message_id)
+        if key in self._deleted_msgs:
+            return
+        # Bots cannot delete messages older than 48 hours, so don't spend an API call trying
+        if sent_at is not None and time.time() - sent_at > 48 * 3600:
+            return
+        await self._throttle(chat_id)
         try:
             await self.bot.delete_message(chat_id, message_id)
-        except:
-            pass
+        except asyncio.TimeoutError as e:
+            logging.debug("Cleanup of message %s timed out: %s", message_id, e)
+            return
+        except ApiTelegramException as e:
+            # Already deleted or not deletable; retrying would fail the same way
+            logging.debug("Cleanup of message %s failed: %s", message_id, e)
+        self._deleted_msgs[key] = None
+        if len(self._deleted_msgs) > Config.DELETED_MESSAGES_CACHE:
+            self._deleted_msgs.popitem(last=False)
 
     async def _start_handler(self, message: Message):
         user_id = message.from_user.id
@@ -455,77 +1227,39 @@ class ModernQuizBot:
             name=message.from_user.first_name or "User",
             username=message.from_user.username or "NoUsername"
         )
-        await self.db.save_user(user)
         
         if user_id == self.admin_id:
+            await self.db.save_user(user)
             await self._show_admin_dashboard(message.chat.id)
             return
         
         in_channel = await self._check_channel_membership(user_id)
-        await self.db.update_user_channel_status(user_id, in_channel)
+        profile_confirmed = await self.db.upsert_user(user, in_channel)
         
         if not in_channel:
             await self._show_channel_requirement(message.chat.id)
             return
         
-        user_data = await self.db.get_user(user_id)
-        if user_data and not user_data.profile_confirmed:
+        if not profile_confirmed:
             await self._ask_profile_confirmation(message.chat.id)
             return
         
         await self._show_main_menu(message.chat.id)
 
     async def _show_channel_requirement(self, chat_id: int):
-        markup = InlineKeyboardMarkup()
-        channel_link = Config.MANDATORY_CHANNEL.lstrip('@')
-        markup.add(InlineKeyboardButton("📢 Join Channel", url=f"https://t.me/{channel_link}"))
-        markup.add(InlineKeyboardButton("✅ I've Joined", callback_data="check_channel"))
-        
-        text = f"""🔒 **Channel Membership Required**
-
-To access quizzes, join our channel first!
-
-📢 **Channel:** {Config.MANDATORY_CHANNEL}
-
-**After joining, click "I've Joined" below!**"""
-        
-        await self.bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+        await self._safe_send(chat_id, _CHANNEL_REQUIREMENT_TEXT, reply_markup=self._static_markups['channel_requirement'], parse_mode='Markdown')
 
     async def _ask_profile_confirmation(self, chat_id: int):
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("✅ Confirm My Profile", callback_data="confirm_profile"))
-        
-        text = """👤 **Profile Confirmation**
-
-Confirm your profile to continue!"""
-        
-        await self.bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+        await self._safe_send(chat_id, _PROFILE_CONFIRMATION_TEXT, reply_markup=self._static_markups['profile_confirmation'], parse_mode='Markdown')
 
     async def _show_main_menu(self, chat_id: int):
-        markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-        markup.add(
-            KeyboardButton("🎯 Take Quiz"),
-            KeyboardButton("📊 My Profile"),
-            KeyboardButton("🏆 Top Scorers"),
-            KeyboardButton("💬 Help & Support")
-        )
-        
-        text = """✨ **Welcome to HU Quizzes!** ✨
-
-🎯 Take interactive quizzes
-📊 Track your progress  
-🏆 Compete with others
-💬 Get support
-
-**Choose an option below:**"""
-        
-        await self.bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+        await self._safe_send(chat_id, _MAIN_MENU_TEXT, reply_markup=self._static_markups['main_menu'], parse_mode='Markdown')
 
     async def _admin_handler(self, message: Message):
         user_id = message.from_user.id
         
         if user_id != self.admin_id:
-            await self.bot.send_message(
+            await self._safe_send(
                 message.chat.id,
                 "⛔ **Access Denied**\n\nAdmin panel only!",
                 parse_mode='Markdown'
@@ -535,38 +1269,10 @@ Confirm your profile to continue!"""
         await self._show_admin_dashboard(message.chat.id)
 
     async def _show_admin_dashboard(self, chat_id: int):
-        markup = InlineKeyboardMarkup(row_width=2)
+        total_users, pending_help = await self.db.get_dashboard_counts()
+        dashboard_text = _ADMIN_DASHBOARD_TEXT.format(total_users=total_users, pending_help=pending_help)
         
-        markup.add(
-            InlineKeyboardButton("📤 Upload Quiz", callback_data="admin_upload"),
-            InlineKeyboardButton("📊 View Scores", callback_data="admin_scores")
-        )
-        markup.add(
-            InlineKeyboardButton("➕ Add Subject", callback_data="admin_add_subject"),
-            InlineKeyboardButton("📖 Add Chapter", callback_data="admin_add_chapter")
-        )
-        markup.add(
-            InlineKeyboardButton("👥 Manage Users", callback_data="admin_manage_users"),
-            InlineKeyboardButton("📩 Help Requests", callback_data="admin_help_requests")
-        )
-        
-        async with aiosqlite.connect(Config.DB_FILE) as db:
-            async with db.execute("SELECT COUNT(*) FROM users") as cursor:
-                total_users = (await cursor.fetchone())[0] or 0
-            
-            async with db.execute("SELECT COUNT(*) FROM help_requests WHERE admin_reply IS NULL") as cursor:
-                pending_help = (await cursor.fetchone())[0] or 0
-        
-        dashboard_text = f"""
-👑 **ADMIN DASHBOARD**
-
-📊 **Statistics:**
-├ 👥 **Users:** `{total_users}`
-└ 📩 **Pending Help:** `{pending_help}`
-
-**Select an action:**"""
-        
-        await self.bot.send_message(chat_id, dashboard_text, reply_markup=markup, parse_mode='Markdown')
+        await self._safe_send(chat_id, dashboard_text, reply_markup=self._static_markups['admin_dashboard'], parse_mode='Markdown')
 
     async def _help_handler(self, message: Message):
         user_id = message.from_user.id
@@ -578,78 +1284,73 @@ Confirm your profile to continue!"""
         await self._show_help_options(message.chat.id)
 
     async def _show_help_options(self, chat_id: int):
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("📝 Ask Question", callback_data="ask_question"))
-        markup.add(InlineKeyboardButton("📋 My Questions", callback_data="my_questions"))
-        markup.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
-        
-        text = """💬 **Help & Support**
+        await self._safe_send(chat_id, _HELP_OPTIONS_TEXT, reply_markup=self._static_markups['help_options'], parse_mode='Markdown')
 
-Need help? Choose below:"""
-        
-        await self.bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+    def _build_menu_routes(self):
+        self._menu_routes = {
+            "🎯 Take Quiz": self._cb_back_subjects,
+            "📊 My Profile": self._cb_view_profile,
+            "🏆 Top Scorers": self._cb_top_scorers,
+            "💬 Help & Support": self._cb_help_options,
+        }
 
     async def _text_handler(self, message: Message):
+        user_id = message.from_user.id
+        async with self._state_lock(user_id):
+            await self._handle_text(message)
+
+    async def _handle_text(self, message: Message):
         user_id = message.from_user.id
         text = message.text
         chat_id = message.chat.id
+        state = self._get_state(user_id)
         
         if user_id == self.admin_id:
-            if self.user_states.get(user_id) == 'waiting_subject_name':
+            if state is UserState.WAITING_SUBJECT:
                 await self._process_admin_subject_name(chat_id, text)
                 return
-            elif self.user_states.get(user_id) == 'waiting_chapter_name':
+            elif state is UserState.WAITING_CHAPTER:
                 await self._process_admin_chapter_name(chat_id, text)
                 return
-            elif self.user_states.get(user_id) == 'waiting_help_reply':
+            elif state is UserState.WAITING_HELP_REPLY:
                 await self._process_admin_help_reply(chat_id, text)
                 return
         
-        if self.user_states.get(user_id) == 'asking_question':
+        if state is UserState.ASKING_QUESTION:
             await self._handle_user_question(message)
             return
         
-        if text == "🎯 Take Quiz":
-            await self._show_subjects(chat_id)
-        elif text == "📊 My Profile":
-            await self._show_user_profile(chat_id, user_id)
-        elif text == "🏆 Top Scorers":
-            await self._show_top_scorers(chat_id)
-        elif text == "💬 Help & Support":
-            await self._show_help_options(chat_id)
+        handler = self._menu_routes.get(text)
+        if handler is not None:
+            await handler(chat_id, user_id, text)
         else:
             if user_id == self.admin_id:
                 await self._show_admin_dashboard(chat_id)
             else:
-                await self.bot.send_message(chat_id, "🤔 Use buttons to navigate!", reply_markup=self._get_main_menu_markup())
+                await self._safe_send(chat_id, "🤔 Use buttons to navigate!", reply_markup=self._static_markups['main_menu'])
 
     async def _process_admin_subject_name(self, chat_id: int, subject_name: str):
         await self.db.add_subject(subject_name)
-        self.user_states[self.admin_id] = {'waiting_chapter_name': subject_name}
-        await self.bot.send_message(chat_id, f"✅ Subject '{subject_name}' added!\n\nNow send chapter name:")
+        self._states[self.admin_id] = StateCtx(UserState.WAITING_CHAPTER, subject_name=subject_name)
+        await self._safe_send(chat_id, f"✅ Subject '{subject_name}' added!\n\nNow send chapter name:")
 
     async def _process_admin_chapter_name(self, chat_id: int, chapter_name: str):
-        subject_name = self.user_states[self.admin_id]['waiting_chapter_name']
+        subject_name = self._states[self.admin_id].subject_name
         await self.db.add_chapter(subject_name, chapter_name)
-        self.user_states.pop(self.admin_id, None)
-        await self.bot.send_message(chat_id, f"✅ Chapter '{chapter_name}' added!\n\nNow upload JSON quiz file.")
+        self._states[self.admin_id] = StateCtx(UserState.WAITING_UPLOAD, subject_name=subject_name, chapter_name=chapter_name)
+        await self._safe_send(chat_id, f"✅ Chapter '{chapter_name}' added!\n\nNow upload JSON quiz file.")
 
     async def _process_admin_help_reply(self, chat_id: int, admin_reply: str):
-        request_id = self.user_states[self.admin_id]['help_request_id']
-        await self.db.reply_to_help_request(request_id, admin_reply)
-        
-        async with aiosqlite.connect(Config.DB_FILE) as db:
-            async with db.execute("SELECT user_id FROM help_requests WHERE id = ?", (request_id,)) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    target_user_id = row[0]
-                    try:
-                        await self.bot.send_message(target_user_id, f"📨 **Admin Reply:**\n\n{admin_reply}")
-                    except:
-                        pass
-        
-        self.user_states.pop(self.admin_id, None)
-        await self.bot.send_message(chat_id, "✅ Reply sent!")
+        request_id = self._states[self.admin_id].help_request_id
+        target_user_id = await self.db.reply_to_help_request(request_id, admin_reply)
+        if target_user_id:
+            try:
+                await self._safe_send(target_user_id, f"📨 **Admin Reply:**\n\n{admin_reply}")
+            except (ApiTelegramException, asyncio.TimeoutError) as e:
+                logging.debug("Admin reply delivery to %s failed: %s", target_user_id, e)
+        
+        self._states.pop(self.admin_id, None)
+        await self._safe_send(chat_id, "✅ Reply sent!")
         await self._show_admin_help_requests(chat_id)
 
     async def _handle_user_question(self, message: Message):
@@ -657,66 +1358,68 @@ Need help? Choose below:"""
         question = message.text
         
         await self.db.create_help_request(user_id, question)
-        self.user_states.pop(user_id, None)
+        self._states.pop(user_id, None)
         
         user = await self.db.get_user(user_id)
-        admin_text = f"🆘 **New Help Request**\n\n**From:** {user.name}\n**User ID:** {user_id}\n\n**Question:** {question}"
+        admin_text = f"🆘 **New Help Request**\n\n**From:** {_md_escape(user.name)}\n**User ID:** {user_id}\n\n**Question:** {_md_escape(question)}"
         
         try:
-            await self.bot.send_message(self.admin_id, admin_text, parse_mode='Markdown')
-        except:
-            pass
+            await self._safe_send(self.admin_id, admin_text, parse_mode='Markdown')
+        except (ApiTelegramException, asyncio.TimeoutError) as e:
+            logging.debug("Help request notification failed: %s", e)
         
-        await self.bot.send_message(message.chat.id, "✅ Question sent to admin!", reply_markup=self._get_main_menu_markup())
+        await self._safe_send(message.chat.id, "✅ Question sent to admin!", reply_markup=self._static_markups['main_menu'])
 
     async def _document_handler(self, message: Message):
         if message.from_user.id != self.admin_id:
             return
 
+        async with self._state_lock(self.admin_id):
+            await self._handle_quiz_upload(message)
+
+    async def _handle_quiz_upload(self, message: Message):
         try:
             file_info = await self.bot.get_file(message.document.file_id)
             downloaded_file = await self.bot.download_file(file_info.file_path)
-            quiz_data = json.loads(downloaded_file.decode('utf-8'))
-            
-            if not self.quiz_service.validate_quiz_data(quiz_data):
-                await self.bot.send_message(message.chat.id, "❌ Invalid quiz format!")
+            # Large uploads are decoded and validated off the event loop
+            questions = await asyncio.to_thread(self.quiz_service.load_questions, downloaded_file)
+            if questions is None:
+                await self._safe_send(message.chat.id, "❌ Invalid quiz format!")
                 return
             
-            user_state = self.user_states.get(self.admin_id, {})
-            if 'waiting_chapter_name' in user_state:
-                subject_name = user_state['waiting_chapter_name']
-                chapter_name = message.document.file_name.replace('.json', '').replace('.JSON', '')
+            ctx = self._states.get(self.admin_id)
+            if ctx and ctx.state in (UserState.WAITING_CHAPTER, UserState.WAITING_UPLOAD):
+                subject_name = ctx.subject_name
+                if ctx.chapter_name:
+                    chapter_name = ctx.chapter_name
+                else:
+                    # No chapter typed yet: the file name names the chapter
+                    file_name = message.document.file_name
+                    stem, ext = os.path.splitext(file_name)
+                    chapter_name = stem if ext.lower() == '.json' else file_name
+                    await self.db.add_chapter(subject_name, chapter_name)
                 
-                questions = [Question(**q) for q in quiz_data]
                 success = await self.db.save_quiz(subject_name, chapter_name, questions)
                 
                 if success:
-                    await self.bot.send_message(message.chat.id, f"✅ **Quiz uploaded!**\n\n📚 **Subject:** {subject_name}\n📖 **Chapter:** {chapter_name}\n❓ **Questions:** {len(questions)}", parse_mode='Markdown')
+                    if ctx.state is UserState.WAITING_UPLOAD:
+                        self._states.pop(self.admin_id, None)
+                    await self._safe_send(message.chat.id, f"✅ **Quiz uploaded!**\n\n📚 **Subject:** {_md_escape(subject_name)}\n📖 **Chapter:** {_md_escape(chapter_name)}\n❓ **Questions:** {len(questions)}", parse_mode='Markdown')
                 else:
-                    await self.bot.send_message(message.chat.id, "❌ Failed to save quiz.")
+                    await self._safe_send(message.chat.id, "❌ Failed to save quiz.")
             else:
-                await self.bot.send_message(message.chat.id, "📝 Add subject and chapter first!")
+                await self._safe_send(message.chat.id, "📝 Add subject and chapter first!")
             
-        except json.JSONDecodeError:
-            await self.bot.send_message(message.chat.id, "❌ Invalid JSON file!")
+        except orjson.JSONDecodeError:
+            await self._safe_send(message.chat.id, "❌ Invalid JSON file!")
         except Exception as e:
-            await self.bot.send_message(message.chat.id, f"❌ Error: {str(e)}")
-
-    def _get_main_menu_markup(self):
-        markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-        markup.add(
-            KeyboardButton("🎯 Take Quiz"),
-            KeyboardButton("📊 My Profile"), 
-            KeyboardButton("🏆 Top Scorers"),
-            KeyboardButton("💬 Help & Support")
-        )
-        return markup
+            await self._safe_send(message.chat.id, f"❌ Error: {str(e)}")
 
     async def _show_subjects(self, chat_id: int):
         subjects = await self.db.get_subjects()
         
         if not subjects:
-            await self.bot.send_message(chat_id, "📭 No subjects available!")
+            await self._safe_send(chat_id, "📭 No subjects available!")
             return
 
         markup = InlineKeyboardMarkup(row_width=2)
@@ -726,13 +1429,13 @@ Need help? Choose below:"""
         
         markup.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
         
-        await self.bot.send_message(chat_id, "🎯 **Choose Subject:**", reply_markup=markup, parse_mode='Markdown')
+        await self._safe_send(chat_id, "🎯 **Choose Subject:**", reply_markup=markup, parse_mode='Markdown')
 
     async def _show_chapters(self, chat_id: int, subject_id: int, subject_name: str):
         chapters = await self.db.get_chapters(subject_id)
         
         if not chapters:
-            await self.bot.send_message(chat_id, f"📭 No chapters for {subject_name}!")
+            await self._safe_send(chat_id, f"📭 No chapters for {subject_name}!")
             return
 
         markup = InlineKeyboardMarkup(row_width=2)
@@ -741,12 +1444,12 @@ Need help? Choose below:"""
         
         markup.add(InlineKeyboardButton("🔙 Back", callback_data="back_subjects"))
         
-        await self.bot.send_message(chat_id, f"📚 **{subject_name}**\n\nChoose chapter:", reply_markup=markup, parse_mode='Markdown')
+        await self._safe_send(chat_id, f"📚 **{_md_escape(subject_name)}**\n\nChoose chapter:", reply_markup=markup, parse_mode='Markdown')
 
     async def _start_quiz(self, chat_id: int, user_id: int, chapter_id: int):
         quiz = await self.db.get_quiz(chapter_id)
         if not quiz:
-            await self.bot.send_message(chat_id, "❌ Quiz not available!")
+            await self._safe_send(chat_id, "❌ Quiz not available!")
             return
 
         progress = await self.db.get_progress(user_id, chapter_id)
@@ -756,17 +1459,25 @@ Need help? Choose below:"""
             markup.add(InlineKeyboardButton("🔄 Retake", callback_data=f"retake_{chapter_id}"))
             markup.add(InlineKeyboardButton("📚 Other", callback_data="back_subjects"))
             
-            await self.bot.send_message(chat_id, f"✅ Completed!\n🎯 **Score:** {progress.score}/{len(quiz)}\n\nRetake?", reply_markup=markup, parse_mode='Markdown')
+            await self._safe_send(chat_id, f"✅ Completed!\n🎯 **Score:** {progress.score}/{len(quiz)}\n\nRetake?", reply_markup=markup, parse_mode='Markdown')
             return
 
-        await self._send_question(chat_id, user_id, chapter_id, 0)
+        await self._send_question(chat_id, user_id, chapter_id, 0, quiz, progress)
 
-    async def _send_question(self, chat_id: int, user_id: int, chapter_id: int, question_index: int):
-        quiz = await self.db.get_quiz(chapter_id)
-        progress = await self.db.get_progress(user_id, chapter_id)
+    async def _load_quiz_session(self, user_id: int, chapter_id: int) -> Tuple[Optional[List[Question]], QuizProgress]:
+        return await asyncio.gather(
+            self.db.get_quiz(chapter_id),
+            self.db.get_progress(user_id, chapter_id)
+        )
+
+    async def _send_question(self, chat_id: int, user_id: int, chapter_id: int, question_index: int,
+                             quiz: Optional[List[Question]] = None, progress: Optional[QuizProgress] = None):
+        # Callers that already hold the quiz and progress pass them through
+        if quiz is None or progress is None:
+            quiz, progress = await self._load_quiz_session(user_id, chapter_id)
         
         if question_index >= len(quiz):
-            await self._complete_quiz(chat_id, user_id, chapter_id)
+            await self._complete_quiz(chat_id, user_id, chapter_id, quiz, progress)
             return
 
         question = quiz[question_index]
@@ -777,33 +1488,43 @@ Need help? Choose below:"""
 ❓ **Question {question_index + 1}/{len(quiz)}:**
 {question.question}"""
 
-        markup = InlineKeyboardMarkup(row_width=2)
-        for i, option in enumerate(question.options):
-            emoji = ["🅰️", "🅱️", "🇨", "🇩"][i] if i < 4 else f"{i+1}️⃣"
-            markup.add(InlineKeyboardButton(f"{emoji} {option}", callback_data=f"answer_{chapter_id}_{question_index}_{i}"))
-
-        if progress.last_message_id:
-            await self._cleanup_previous_message(chat_id, progress.last_message_id)
+        markup = self._get_question_markup(chapter_id, question_index, question)
 
-        msg = await self.bot.send_message(chat_id, question_text, reply_markup=markup, parse_mode='Markdown')
+        if question_index > 0:
+            message_id = await self._edit_or_send(chat_id, progress.last_message_id, question_text, reply_markup=markup, parse_mode='Markdown')
+        else:
+            if progress.last_message_id:
+                await self._cleanup_previous_message(chat_id, progress.last_message_id)
+            msg = await self._safe_send(chat_id, question_text, reply_markup=markup, parse_mode='Markdown')
+            message_id = msg.message_id
         
         progress.current_index = question_index
-        progress.last_message_id = msg.message_id
+        progress.last_message_id = message_id
         await self.db.save_progress(user_id, chapter_id, progress)
 
+    def _get_question_markup(self, chapter_id: int, question_index: int, question: Question) -> InlineKeyboardMarkup:
+        # Same keyboard for every user; a re-uploaded quiz brings new Question objects
+        cached = self._question_markups.get((chapter_id, question_index))
+        if cached is not None and cached[0] is question:
+            return cached[1]
+        
+        markup = InlineKeyboardMarkup(row_width=2)
+        for i, option in enumerate(question.options):
+            emoji = _OPTION_EMOJI[i] if i < len(_OPTION_EMOJI) else f"{i+1}️⃣"
+            markup.add(InlineKeyboardButton(f"{emoji} {option}", callback_data=f"answer_{chapter_id}_{question_index}_{i}"))
+        self._question_markups[(chapter_id, question_index)] = (question, markup)
+        return markup
+
     async def _handle_answer(self, call: CallbackQuery):
         try:
-            _, chapter_id, question_index, answer_idx = call.data.split("_")
-            chapter_id = int(chapter_id)
-            question_index = int(question_index)
-            answer_idx = int(answer_idx)
+            _, chapter_id, question_index, answer_idx = call.data.split("_", 3)
+            chapter_id, question_index, answer_idx = int(chapter_id), int(question_index), int(answer_idx)
             
             user_id = call.from_user.id
             chat_id = call.message.chat.id
 
-            quiz = await self.db.get_quiz(chapter_id)
+            quiz, progress = await self._load_quiz_session(user_id, chapter_id)
             question = quiz[question_index]
-            progress = await self.db.get_progress(user_id, chapter_id)
 
             if len(progress.answers) <= question_index:
                 progress.answers.append(answer_idx)
@@ -818,22 +1539,24 @@ Need help? Choose below:"""
                 await self.db.save_progress(user_id, chapter_id, progress)
                 await self.bot.answer_callback_query(call.id, response_text, show_alert=True)
                 
-                await self._cleanup_previous_message(chat_id, call.message.message_id)
-                
                 await asyncio.sleep(1)
-                await self._send_question(chat_id, user_id, chapter_id, question_index + 1)
+                await self._send_question(chat_id, user_id, chapter_id, question_index + 1, quiz, progress)
             else:
                 await self.bot.answer_callback_query(call.id, "⚠️ Already answered!")
                 
         except Exception as e:
             await self.bot.answer_callback_query(call.id, "❌ Error!")
 
-    async def _complete_quiz(self, chat_id: int, user_id: int, chapter_id: int):
-        quiz = await self.db.get_quiz(chapter_id)
-        progress = await self.db.get_progress(user_id, chapter_id)
+    async def _complete_quiz(self, chat_id: int, user_id: int, chapter_id: int,
+                             quiz: Optional[List[Question]] = None, progress: Optional[QuizProgress] = None):
+        if quiz is None or progress is None:
+            quiz, progress = await self._load_quiz_session(user_id, chapter_id)
         
         progress.completed = True
         await self.db.save_progress(user_id, chapter_id, progress)
+        # Score and rank queries read SQLite, so persist the final result now
+        await self.db.flush_progress()
+        self.db.release_progress(user_id, chapter_id)
         
         score = progress.score
         total = len(quiz)
@@ -855,325 +1578,451 @@ Need help? Choose below:"""
 
 {message}"""
         
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("📊 Profile", callback_data="view_profile"))
-        markup.add(InlineKeyboardButton("🎯 Another", callback_data="back_subjects"))
-        markup.add(InlineKeyboardButton("🏠 Menu", callback_data="main_menu"))
-        
-        await self.bot.send_message(chat_id, completion_text, reply_markup=markup, parse_mode='Markdown')
+        await self._edit_or_send(chat_id, progress.last_message_id, completion_text, reply_markup=self._static_markups['quiz_complete'], parse_mode='Markdown')
 
     async def _show_user_profile(self, chat_id: int, user_id: int):
-        user = await self.db.get_user(user_id)
-        total_score = await self.db.get_user_total_score(user_id)
-        top_scorers = await self.db.get_top_scorers_weekly(limit=10)
-        
-        user_rank = "Not ranked"
-        for scorer in top_scorers:
-            if scorer['username'] == user.username or scorer['name'] == user.name:
-                user_rank = scorer['rank']
-                break
+        user, total_score, user_rank = await asyncio.gather(
+            self.db.get_user(user_id),
+            self.db.get_user_total_score(user_id),
+            self.db.get_user_weekly_rank(user_id)
+        )
+        user_rank = user_rank or "Not ranked"
         
         profile_text = f"""👤 **Your Profile**
 
-📛 **Name:** {user.name}
+📛 **Name:** {_md_escape(user.name)}
 🏆 **Total Score:** {total_score} points
 📊 **Weekly Rank:** #{user_rank}
 
 ✅ **Profile:** Confirmed
 ✅ **Channel:** Joined"""
         
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("🔄 Refresh", callback_data="view_profile"))
-        markup.add(InlineKeyboardButton("🏠 Menu", callback_data="main_menu"))
-        
-        await self.bot.send_message(chat_id, profile_text, reply_markup=markup, parse_mode='Markdown')
+        await self._safe_send(chat_id, profile_text, reply_markup=self._static_markups['user_profile'], parse_mode='Markdown')
 
     async def _show_top_scorers(self, chat_id: int):
         top_scorers = await self.db.get_top_scorers_weekly(limit=3)
         
         if not top_scorers:
-            await self.bot.send_message(chat_id, "📭 No scores yet!")
+            await self._safe_send(chat_id, "📭 No scores yet!")
             return
 
-        leaderboard_text = "🏆 **Top Scorers This Week**\n\n"
-        
-        medals = ["🥇", "🥈", "🥉"]
-        for i, scorer in enumerate(top_scorers):
-            if i < 3:
-                medal = medals[i]
-                leaderboard_text += f"{medal} **{scorer['name']}**\n   💎 **Score:** {scorer['total_score']}\n\n"
-        
-        leaderboard_text += "💪 Take quizzes to climb!"
-        
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("🔄 Refresh", callback_data="top_scorers"))
-        markup.add(InlineKeyboardButton("🏠 Menu", callback_data="main_menu"))
+        parts = ["🏆 **Top Scorers This Week**\n\n"]
+        parts.extend(
+            f"{medal} **{_md_escape(scorer['name'])}**\n   💎 **Score:** {scorer['total_score']}\n\n"
+            for medal, scorer in zip(_MEDAL_EMOJI, top_scorers)
+        )
+        parts.append("💪 Take quizzes to climb!")
+        leaderboard_text = "".join(parts)
         
-        await self.bot.send_message(chat_id, leaderboard_text, reply_markup=markup, parse_mode='Markdown')
+        await self._safe_send(chat_id, leaderboard_text, reply_markup=self._static_markups['top_scorers'], parse_mode='Markdown')
 
-    async def _show_user_questions(self, chat_id: int, user_id: int):
-        requests = await self.db.get_user_help_requests(user_id)
+    async def _show_user_questions(self, chat_id: int, user_id: int, page: int = 1):
+        # Paged; the whole history would not fit in one message
+        page_size = Config.HELP_PAGE_SIZE
+        requests = await self.db.get_user_help_requests(user_id, offset=(page - 1) * page_size, limit=page_size + 1)
         
         if not requests:
-            await self.bot.send_message(chat_id, "📭 No questions!")
+            await self._safe_send(chat_id, "📭 No questions!")
             return
 
-        text = "📋 **Your Questions**\n\n"
-        for i, (question, reply, created, replied) in enumerate(requests, 1):
-            text += f"**{i}. Question:**\n{question}\n"
-            if reply:
-                text += f"**Reply:** {reply}\n"
-            else:
-                text += "⏳ Waiting...\n"
-            text += "─" * 20 + "\n"
+        has_next = len(requests) > page_size
+        separator = "─" * 20 + "\n"
+        parts = ["📋 **Your Questions**\n\n"]
+        for i, (question, reply, created, replied) in enumerate(requests[:page_size], (page - 1) * page_size + 1):
+            parts.append(f"**{i}. Question:**\n{_md_escape(question)}\n")
+            parts.append(f"**Reply:** {_md_escape(reply)}\n" if reply else "⏳ Waiting...\n")
+            parts.append(separator)
+        text = "".join(parts)
+        
+        markup = None
+        nav = self._page_buttons("myquestions_", page, has_next)
+        if nav:
+            markup = InlineKeyboardMarkup()
+            markup.row(*nav)
         
-        await self.bot.send_message(chat_id, text, parse_mode='Markdown')
+        await self._safe_send(chat_id, text, reply_markup=markup, parse_mode='Markdown')
 
-    async def _show_admin_help_requests(self, chat_id: int):
-        requests = await self.db.get_pending_help_requests()
+    @staticmethod
+    def _page_buttons(prefix: str, page: int, has_next: bool) -> List[InlineKeyboardButton]:
+        buttons = []
+        if page > 1:
+            buttons.append(InlineKeyboardButton("◀ Prev", callback_data=f"{prefix}{page - 1}"))
+        if has_next:
+            buttons.append(InlineKeyboardButton("Next ▶", callback_data=f"{prefix}{page + 1}"))
+        return buttons
+
+    async def _show_admin_scores(self, chat_id: int, page: int = 1):
+        page_size = Config.SCORES_PAGE_SIZE
+        # One extra row tells whether a next page exists
+        scores = await self.db.get_all_scores(offset=(page - 1) * page_size, limit=page_size + 1)
+        if not scores:
+            await self._safe_send(chat_id, "📭 No scores!")
+            return
+        
+        has_next = len(scores) > page_size
+        text = "📊 **All User Scores**\n\n" + "".join(
+            f"**{score['rank']}. {_md_escape(score['name'])}** - {score['total_score']} points\n"
+            for score in scores[:page_size]
+        )
+        
+        nav = self._page_buttons("admin_scores_p", page, has_next)
+        if nav:
+            markup = InlineKeyboardMarkup()
+            markup.row(*nav)
+            markup.add(_ADMIN_BACK_BUTTON)
+        else:
+            markup = self._static_markups['admin_back']
+        
+        await self._safe_send(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+
+    async def _show_admin_help_requests(self, chat_id: int, page: int = 1):
+        page_size = Config.HELP_PAGE_SIZE
+        requests = await self.db.get_pending_help_requests(offset=(page - 1) * page_size, limit=page_size + 1)
         
         if not requests:
-            await self.bot.send_message(chat_id, "✅ No pending requests!")
+            await self._safe_send(chat_id, "✅ No pending requests!")
             return
 
-        text = "📩 **Pending Help Requests**\n\n"
-        markup = InlineKeyboardMarkup(row_width=1)
-        
-        for request_id, name, user_id, message, created in requests:
+        has_next = len(requests) > page_size
+        entries = []
+        buttons = []
+        for request_id, name, user_id, message, created in requests[:page_size]:
             short_msg = message[:30] + "..." if len(message) > 30 else message
-            text += f"🆘 **{name}**\n📝 {short_msg}\n\n"
-            markup.add(InlineKeyboardButton(f"📝 Reply to {name}", callback_data=f"admin_reply_{request_id}"))
-        
-        markup.add(InlineKeyboardButton("🔙 Back", callback_data="admin_dashboard"))
+            entries.append(f"🆘 **{_md_escape(name)}**\n📝 {_md_escape(short_msg)}\n\n")
+            buttons.append(InlineKeyboardButton(f"📝 Reply to {name}", callback_data=f"admin_reply_{request_id}"))
         
-        await self.bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+        text = "📩 **Pending Help Requests**\n\n" + "".join(entries)
+        markup = InlineKeyboardMarkup(row_width=1)
+        markup.add(*buttons)
+        nav = self._page_buttons("admin_help_p", page, has_next)
+        if nav:
+            markup.row(*nav)
+        markup.add(_ADMIN_BACK_BUTTON)
+        
+        await self._safe_send(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+
+    def _build_callback_routes(self):
+        self._callback_exact = {
+            "check_channel": self._cb_check_channel,
+            "confirm_profile": self._cb_confirm_profile,
+            "main_menu": self._cb_main_menu,
+            "back_subjects": self._cb_back_subjects,
+            "view_profile": self._cb_view_profile,
+            "top_scorers": self._cb_top_scorers,
+            "ask_question": self._cb_ask_question,
+            "my_questions": self._cb_my_questions,
+            "admin_dashboard": self._cb_admin_dashboard,
+            "admin_upload": self._cb_admin_upload,
+            "admin_scores": self._cb_admin_scores,
+            "admin_add_subject": self._cb_admin_add_subject,
+            "admin_add_chapter": self._cb_admin_add_chapter,
+            "admin_manage_users": self._cb_admin_manage_users,
+            "admin_help_requests": self._cb_admin_help_requests,
+            "admin_check_members": self._cb_admin_check_members,
+            "admin_settings": self._cb_admin_settings,
+        }
+        # Keyed by the text before the first "_"; the handler gets the rest
+        self._callback_prefixes = {
+            "subject": self._cb_subject,
+            "chapter": self._cb_chapter,
+            "retake": self._cb_retake,
+            "myquestions": self._cb_my_questions_page,
+        }
+        self._admin_callback_prefixes = (
+            ("admin_reply_", self._cb_admin_reply),
+            ("admin_delete_user_", self._cb_admin_delete_user),
+            ("admin_scores_p", self._cb_admin_scores_page),
+            ("admin_help_p", self._cb_admin_help_page),
+        )
 
     async def _callback_handler(self, call: CallbackQuery):
+        async with self._state_lock(call.from_user.id):
+            await self._handle_callback(call)
+
+    async def _handle_callback(self, call: CallbackQuery):
         try:
             data = call.data
             user_id = call.from_user.id
             chat_id = call.message.chat.id
 
-            await self._cleanup_previous_message(chat_id, call.message.message_id)
+            head, _, rest = data.partition("_")
 
-            if data == "check_channel":
-                in_channel = await self._check_channel_membership(user_id)
-                await self.db.update_user_channel_status(user_id, in_channel)
-                
-                if in_channel:
-                    await self._ask_profile_confirmation(chat_id)
-                else:
-                    await self.bot.send_message(chat_id, "❌ Join channel first!")
-                    
-            elif data == "confirm_profile":
-                await self.db.confirm_user_profile(user_id)
-                await self._show_main_menu(chat_id)
-                
-            elif data == "main_menu":
-                if user_id == self.admin_id:
-                    await self._show_admin_dashboard(chat_id)
-                else:
-                    await self._show_main_menu(chat_id)
-                    
-            elif data == "back_subjects":
-                await self._show_subjects(chat_id)
-                
-            elif data.startswith("subject_"):
-                subject_id = int(data.split("_")[1])
-                subjects = await self.db.get_subjects()
-                subject_name = next((name for id, name, desc in subjects if id == subject_id), "Unknown")
-                await self._show_chapters(chat_id, subject_id, subject_name)
-                
-            elif data.startswith("chapter_"):
-                chapter_id = int(data.split("_")[1])
-                await self._start_quiz(chat_id, user_id, chapter_id)
-                
-            elif data.startswith("answer_"):
+            if head == "admin" and user_id != self.admin_id:
+                await self.bot.answer_callback_query(call.id, "⛔ Admin only!")
+                return
+
+            # Answers edit the question message in place instead of deleting it
+            if head == "answer":
                 await self._handle_answer(call)
                 return
-                
-            elif data == "view_profile":
-                await self._show_user_profile(chat_id, user_id)
-                
-            elif data == "top_scorers":
-                await self._show_top_scorers(chat_id)
-                
-            elif data == "ask_question":
-                self.user_states[user_id] = 'asking_question'
-                await self.bot.send_message(chat_id, "📝 **Type your question:**", parse_mode='Markdown')
-                
-            elif data == "my_questions":
-                await self._show_user_questions(chat_id, user_id)
-                
-            elif data == "admin_dashboard":
-                await self._show_admin_dashboard(chat_id)
-                
-            elif data == "admin_upload":
-                await self._show_admin_upload_guide(chat_id)
-                
-            elif data == "admin_scores":
-                scores = await self.db.get_all_scores()
-                if not scores:
-                    await self.bot.send_message(chat_id, "📭 No scores!")
-                    return
-                
-                text = "📊 **All User Scores**\n\n"
-                for score in scores:
-                    text += f"**{score['rank']}. {score['name']}** - {score['total_score']} points\n"
-                
-                markup = InlineKeyboardMarkup()
-                markup.add(InlineKeyboardButton("🔙 Back", callback_data="admin_dashboard"))
-                
-                await self.bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
-                
-            elif data == "admin_add_subject":
-                self.user_states[user_id] = 'waiting_subject_name'
-                await self.bot.send_message(chat_id, "📝 **Enter subject name:**", parse_mode='Markdown')
-                
-            elif data == "admin_add_chapter":
-                self.user_states[user_id] = 'waiting_subject_name'
-                await self.bot.send_message(chat_id, "📝 **Enter subject name for chapter:**", parse_mode='Markdown')
-                
-            elif data == "admin_manage_users":
-                await self._show_admin_user_management(chat_id)
-                
-            elif data == "admin_help_requests":
-                await self._show_admin_help_requests(chat_id)
-                
-            elif data.startswith("admin_reply_"):
-                request_id = int(data.split("_")[2])
-                self.user_states[user_id] = {'waiting_help_reply': True, 'help_request_id': request_id}
-                await self.bot.send_message(chat_id, "💬 **Enter your reply:**", parse_mode='Markdown')
-                
-            elif data.startswith("retake_"):
-                chapter_id = int(data.split("_")[1])
-                progress = await self.db.get_progress(user_id, chapter_id)
-                progress.current_index = 0
-                progress.score = 0
-                progress.answers = []
-                progress.completed = False
-                await self.db.save_progress(user_id, chapter_id, progress)
-                await self._start_quiz(chat_id, user_id, chapter_id)
-                
-            elif data.startswith("admin_delete_user_"):
-                user_id_to_delete = int(data.split("_")[3])
-                await self.db.delete_user(user_id_to_delete)
-                await self.bot.send_message(chat_id, f"✅ User {user_id_to_delete} deleted!")
-                await self._show_admin_user_management(chat_id)
-                
-            elif data == "admin_settings":
-                await self._show_admin_settings(chat_id)
+
+            # Every other button gets an empty ack up front so its spinner stops at once
+            try:
+                await self.bot.answer_callback_query(call.id)
+            except (ApiTelegramException, asyncio.TimeoutError) as e:
+                logging.debug("Callback ack failed: %s", e)
+
+            await self._cleanup_previous_message(chat_id, call.message.message_id, call.message.date)
+
+            handler = self._callback_exact.get(data)
+            if handler is not None:
+                await handler(chat_id, user_id, data)
+                return
+
+            handler = self._callback_prefixes.get(head)
+            if handler is not None:
+                await handler(chat_id, user_id, rest)
+                return
+
+            if head == "admin":
+                for prefix, handler in self._admin_callback_prefixes:
+                    if data.startswith(prefix):
+                        await handler(chat_id, user_id, data[len(prefix):])
+                        return
                 
         except Exception as e:
-            logging.error(f"Callback error: {e}")
-            await self.bot.send_message(chat_id, "❌ An error occurred!")
+            logging.error("Callback error: %s", e)
+            await self._safe_send(chat_id, "❌ An error occurred!")
 
-    async def _show_admin_upload_guide(self, chat_id: int):
-        guide_text = """
-📤 **Upload Quiz JSON**
+    async def _cb_check_channel(self, chat_id: int, user_id: int, data: str):
+        was_in_channel = user_id in self._membership_cache
+        in_channel = await self._check_channel_membership(user_id)
+        if not (was_in_channel and in_channel):
+            await self.db.update_user_channel_status(user_id, in_channel)
+        
+        if in_channel:
+            await self._ask_profile_confirmation(chat_id)
+        else:
+            await self._safe_send(chat_id, "❌ Join channel first!")
 
-**Step 1: Add Subject**
-1. Click '➕ Add Subject'
-2. Enter subject name
+    async def _cb_confirm_profile(self, chat_id: int, user_id: int, data: str):
+        await self.db.confirm_user_profile(user_id)
+        await self._show_main_menu(chat_id)
 
-**Step 2: Add Chapter**
-1. Click '📖 Add Chapter'  
-2. Enter chapter name
+    async def _cb_main_menu(self, chat_id: int, user_id: int, data: str):
+        if user_id == self.admin_id:
+            await self._show_admin_dashboard(chat_id)
+        else:
+            await self._show_main_menu(chat_id)
 
-**Step 3: Upload JSON**
-Send JSON file as document
+    async def _cb_back_subjects(self, chat_id: int, user_id: int, data: str):
+        await self._show_subjects(chat_id)
 
-**JSON Format:**
-```json
-[
-  {
-    "question": "Question?",
-    "options": ["A", "B", "C", "D"],
-    "correct": 0,
-    "explanation": "Explanation"
-  }
-]
-```"""
-        
-        markup = InlineKeyboardMarkup()
-        markup.add(
-            InlineKeyboardButton("➕ Add Subject", callback_data="admin_add_subject"),
-            InlineKeyboardButton("📖 Add Chapter", callback_data="admin_add_chapter")
+    async def _cb_subject(self, chat_id: int, user_id: int, data: str):
+        subject_id = int(data)
+        subject_name = await self.db.get_subject_name(subject_id) or "Unknown"
+        await self._show_chapters(chat_id, subject_id, subject_name)
+
+    async def _cb_chapter(self, chat_id: int, user_id: int, data: str):
+        await self._start_quiz(chat_id, user_id, int(data))
+
+    async def _cb_view_profile(self, chat_id: int, user_id: int, data: str):
+        await self._show_user_profile(chat_id, user_id)
+
+    async def _cb_top_scorers(self, chat_id: int, user_id: int, data: str):
+        await self._show_top_scorers(chat_id)
+
+    async def _cb_ask_question(self, chat_id: int, user_id: int, data: str):
+        self._states[user_id] = StateCtx(UserState.ASKING_QUESTION)
+        await self._safe_send(chat_id, "📝 **Type your question:**", parse_mode='Markdown')
+
+    async def _cb_help_options(self, chat_id: int, user_id: int, data: str):
+        await self._show_help_options(chat_id)
+
+    async def _cb_my_questions(self, chat_id: int, user_id: int, data: str):
+        await self._show_user_questions(chat_id, user_id)
+
+    async def _cb_my_questions_page(self, chat_id: int, user_id: int, data: str):
+        await self._show_user_questions(chat_id, user_id, max(1, int(data)))
+
+    async def _cb_retake(self, chat_id: int, user_id: int, data: str):
+        chapter_id = int(data)
+        progress = await self.db.get_progress(user_id, chapter_id)
+        progress.current_index = 0
+        progress.score = 0
+        progress.answers = []
+        progress.completed = False
+        await self.db.save_progress(user_id, chapter_id, progress)
+        await self._start_quiz(chat_id, user_id, chapter_id)
+
+    async def _cb_admin_dashboard(self, chat_id: int, user_id: int, data: str):
+        await self._show_admin_dashboard(chat_id)
+
+    async def _cb_admin_upload(self, chat_id: int, user_id: int, data: str):
+        await self._show_admin_upload_guide(chat_id)
+
+    async def _cb_admin_scores(self, chat_id: int, user_id: int, data: str):
+        await self._show_admin_scores(chat_id)
+
+    async def _cb_admin_scores_page(self, chat_id: int, user_id: int, data: str):
+        await self._show_admin_scores(chat_id, max(1, int(data)))
+
+    async def _cb_admin_add_subject(self, chat_id: int, user_id: int, data: str):
+        self._states[user_id] = StateCtx(UserState.WAITING_SUBJECT)
+        await self._safe_send(chat_id, "📝 **Enter subject name:**", parse_mode='Markdown')
+
+    async def _cb_admin_add_chapter(self, chat_id: int, user_id: int, data: str):
+        self._states[user_id] = StateCtx(UserState.WAITING_SUBJECT)
+        await self._safe_send(chat_id, "📝 **Enter subject name for chapter:**", parse_mode='Markdown')
+
+    async def _cb_admin_manage_users(self, chat_id: int, user_id: int, data: str):
+        await self._show_admin_user_management(chat_id)
+
+    async def _cb_admin_help_requests(self, chat_id: int, user_id: int, data: str):
+        await self._show_admin_help_requests(chat_id)
+
+    async def _cb_admin_help_page(self, chat_id: int, user_id: int, data: str):
+        await self._show_admin_help_requests(chat_id, max(1, int(data)))
+
+    async def _cb_admin_check_members(self, chat_id: int, user_id: int, data: str):
+        if self._member_check_task and not self._member_check_task.done():
+            await self._safe_send(chat_id, "⏳ A channel check is already running.")
+            return
+        placeholder = await self._safe_send(chat_id, "⏳ Checking channel members...")
+        self._member_check_task = asyncio.create_task(
+            self._run_member_check(chat_id, placeholder.message_id)
         )
-        markup.add(InlineKeyboardButton("🔙 Back", callback_data="admin_dashboard"))
-        
-        await self.bot.send_message(chat_id, guide_text, reply_markup=markup, parse_mode='Markdown')
+
+    async def _cb_admin_reply(self, chat_id: int, user_id: int, data: str):
+        self._states[user_id] = StateCtx(UserState.WAITING_HELP_REPLY, help_request_id=int(data))
+        await self._safe_send(chat_id, "💬 **Enter your reply:**", parse_mode='Markdown')
+
+    async def _cb_admin_delete_user(self, chat_id: int, user_id: int, data: str):
+        user_id_to_delete = int(data)
+        await self.db.delete_user(user_id_to_delete)
+        await self._safe_send(chat_id, f"✅ User {user_id_to_delete} deleted!")
+        await self._show_admin_user_management(chat_id)
+
+    async def _cb_admin_settings(self, chat_id: int, user_id: int, data: str):
+        await self._show_admin_settings(chat_id)
+
+    async def _show_admin_upload_guide(self, chat_id: int):
+        await self._safe_send(chat_id, _UPLOAD_GUIDE_TEXT, reply_markup=self._static_markups['admin_upload'], parse_mode='Markdown')
 
     async def _show_admin_user_management(self, chat_id: int):
-        async with aiosqlite.connect(Config.DB_FILE) as db:
-            async with db.execute("SELECT user_id, name, username FROM users ORDER BY user_id DESC LIMIT 10") as cursor:
-                users = await cursor.fetchall()
+        users = await self.db.get_recent_users(limit=10)
         
         if not users:
-            await self.bot.send_message(chat_id, "📭 No users!")
+            await self._safe_send(chat_id, "📭 No users!")
             return
         
         text = "👥 **User Management**\n\n"
-        markup = InlineKeyboardMarkup(row_width=1)
-        
+        buttons = []
         for user_id, name, username in users:
             user_display = f"👤 {name}"
             if username and username != "NoUsername":
                 user_display += f" (@{username})"
-            
-            callback_data = f"admin_delete_user_{user_id}"
-            markup.add(InlineKeyboardButton(user_display, callback_data=callback_data))
+            buttons.append(InlineKeyboardButton(user_display, callback_data=f"admin_delete_user_{user_id}"))
         
-        markup.add(InlineKeyboardButton("🔙 Back", callback_data="admin_dashboard"))
+        markup = InlineKeyboardMarkup(row_width=1)
+        markup.add(*buttons, _ADMIN_BACK_BUTTON)
         
-        await self.bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+        await self._safe_send(chat_id, text, reply_markup=markup, parse_mode='Markdown')
 
     async def _show_admin_settings(self, chat_id: int):
-        settings_text = f"""
-⚙️ **Bot Settings**
-
-**Config:**
-• **Admin ID:** `{Config.ADMIN_ID}`
-• **Channel:** `{Config.MANDATORY_CHANNEL}`
-• **Database:** `{Config.DB_FILE}`
-
-**Quick Actions:**"""
-        
-        markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(
-            InlineKeyboardButton("📊 Stats", callback_data="admin_stats"),
-            InlineKeyboardButton("🔧 Tools", callback_data="admin_tools")
+        await self._safe_send(chat_id, _ADMIN_SETTINGS_TEXT, reply_markup=self._static_markups['admin_settings'], parse_mode='Markdown')
+
+    async def _dispatch_update(self, update: Update):
+        async with self._update_sem:
+            await self.bot.process_new_updates([update])
+
+    async def _webhook_handler(self, request: web.Request) -> web.Response:
+        if Config.WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != Config.WEBHOOK_SECRET:
+            return web.Response(status=403)
+        update = Update.de_json(orjson.loads(await request.read()))
+        # Acknowledge right away; slow handlers must not hold up Telegram's delivery
+        task = asyncio.create_task(self._dispatch_update(update))
+        self._update_tasks.add(task)
+        task.add_done_callback(self._update_tasks.discard)
+        return web.Response()
+
+    async def _run_webhook(self):
+        app = web.Application()
+        app.router.add_post(Config.WEBHOOK_PATH, self._webhook_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, Config.WEBHOOK_HOST, Config.WEBHOOK_PORT)
+        await site.start()
+        await self.bot.set_webhook(
+            url=Config.WEBHOOK_URL,
+            secret_token=Config.WEBHOOK_SECRET or None,
+            allowed_updates=Config.ALLOWED_UPDATES
         )
-        markup.add(InlineKeyboardButton("🔙 Back", callback_data="admin_dashboard"))
-        
-        await self.bot.send_message(chat_id, settings_text, reply_markup=markup, parse_mode='Markdown')
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.bot.remove_webhook()
+            await runner.cleanup()
+            # polling() closes the shared API session itself; the webhook path has to
+            await self.bot.close_session()
 
     async def run(self):
-        await self.initialize()
-        logging.info("🤖 Bot is running...")
-        await self.bot.polling(non_stop=True)
+        try:
+            await self.initialize()
+            logging.info("🤖 Bot is running...")
+            if Config.WEBHOOK_URL:
+                await self._run_webhook()
+            else:
+                await self.bot.polling(
+                    non_stop=True,
+                    timeout=Config.POLL_TIMEOUT,
+                    request_timeout=Config.POLL_REQUEST_TIMEOUT,
+                    allowed_updates=Config.ALLOWED_UPDATES
+                )
+        finally:
+            # Let in-flight handlers (webhook or polling) finish so their progress gets flushed below
+            pending = asyncio.all_tasks() - {asyncio.current_task(), *self.db.background_tasks}
+            if pending:
+                await asyncio.wait(pending, timeout=Config.SHUTDOWN_GRACE)
+            await self.db.close()
 
 # ========================
 # 🚀 APPLICATION ENTRY POINT
 # ========================
 async def main():
+    # File and console writes happen on the listener thread, not the event loop
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_handler = logging.FileHandler('quiz_bot.log', encoding='utf-8')
+    stream_handler = logging.StreamHandler()
+    file_handler.setFormatter(formatter)
+    stream_handler.setFormatter(formatter)
+    # Records never use thread/process fields or caller lookup, so skip collecting them
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging._srcfile = None
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('quiz_bot.log', encoding='utf-8'),
-            logging.StreamHandler()
-        ]
+        handlers=[logging.handlers.QueueHandler(log_queue)]
     )
+    listener.start()
     
     bot = ModernQuizBot(Config.API_TOKEN, Config.ADMIN_ID)
     
+    # SIGTERM (docker stop, systemd) unwinds like Ctrl+C so pending progress is flushed
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # Windows event loops have no signal handlers
+    
     try:
         await bot.run()
+    except asyncio.CancelledError:
+        pass
     except Exception as e:
-        logging.error(f"❌ Bot crashed: {e}")
+        logging.error("❌ Bot crashed: %s", e, exc_info=True)
     finally:
         logging.info("🛑 Bot stopped")
+        listener.stop()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # uvloop is optional (it has no Windows build); the stock loop works everywhere
+    try:
+        import uvloop
+        loop_factory = uvloop.new_event_loop
+    except ImportError:
+        loop_factory = None
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        runner.run(main())
@@ -0,0 +1,27 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+for module in ("aiosqlite", "aiohttp", "orjson", "telebot"):
+    pytest.importorskip(module)
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import bot  # noqa: E402
+
+
+def test_initialize_fresh_and_existing_database(tmp_path):
+    db_path = str(tmp_path / "quiz_bot.db")
+
+    async def start_and_stop():
+        db = bot.DatabaseManager(db_path)
+        try:
+            await db.initialize()
+            assert await db.get_user_total_score(1) == 0
+        finally:
+            await db.close()
+
+    # Once on a fresh file, once on the schema it left behind
+    asyncio.run(start_and_stop())
+    asyncio.run(start_and_stop())